@@ -0,0 +1,453 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+"""
+Usage:
+    benchmark.py [options]
+    benchmark.py -h
+
+Generate synthetic langfiles and measure how long each phase of `tgwwlang.py` takes on them,
+how much memory a loaded langfile occupies, and how long short runs of `tgwwlang.py` spend
+on importing modules (according to `python -X importtime`).
+
+Options:
+    -h, --help              Show this message.
+    --strings <n>           Number of strings in the model langfile. [default: 2000]
+    --values <n>            Maximum number of values per string. [default: 3]
+    --placeholders <p>      Fraction of strings that have placeholders. [default: 0.3]
+    --comments <p>          Fraction of strings preceded by a comment. [default: 0.1]
+    --deprecated <p>        Fraction of strings that have a deprecated duplicate.
+                            [default: 0.05]
+    --variants <n>          Number of variant langfiles derived from the base one.
+                            [default: 3]
+    --seed <n>              Seed for the generator. [default: 0]
+    --repeat <n>            Number of measurements per phase; the best one is
+                            reported. [default: 5]
+    --dir <dir>             Directory to write generated langfiles to. By default,
+                            a temporary one is used and removed afterwards.
+    -o, --output <file>     File to write results to, in JSON.
+    --baseline <file>       Results of an earlier run to compare with.
+    --tolerance <percent>   How much slower than the baseline a phase may get before
+                            it is considered a regression. [default: 10]
+
+Exit status is 1 if a regression is found, or if `-h` or `-V` imports any of the modules
+that only the actual work needs.
+"""
+
+from __future__ import division, print_function
+
+import collections
+import contextlib
+import gc
+import io
+import json
+import os.path
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+import docopt
+from   lxml import etree
+import schema
+
+import tgwwlang
+from   tgwwlang import FileID
+
+
+try:
+    timer = time.perf_counter
+except AttributeError: # Python 2.
+    timer = time.time
+
+try:
+    import tracemalloc
+except ImportError: # Python 2.
+    tracemalloc = None
+
+PHASES = [
+    "load_language",
+    "scan_language",
+    "check_mixed_content",
+    "check_available_strings",
+    "check_missing_strings",
+    "check_values",
+    "move_comments",
+    "modify_strings",
+    "reformat",
+    "serialize",
+]
+
+# Short runs of `tgwwlang.py` whose startup is measured. `{model}`, `{target}`, and `{socket}`
+# (a path where no server listens) are substituted.
+STARTUP_COMMANDS = collections.OrderedDict([
+    ("-V", ["-V"]),
+    ("-h", ["-h"]),
+    ("check", ["check", "--no-cache", "--socket", "{socket}", "--model", "{model}", "{target}"]),
+])
+
+# Modules that `-h` and `-V` must not import.
+STARTUP_FORBIDDEN = ["lxml.etree", "multiprocessing", "schema"]
+
+WORDS = (
+    "the wolf village night day vote kill lynch seer guard cursed fool mason cupid drunk "
+    "hunter tanner traitor sorcerer thief angel player players game role team alive dead "
+    "has been is was will you your to of and a in on at by no one nobody everyone"
+).split()
+
+Parameters = collections.namedtuple(
+    "Parameters", "strings  values  placeholders  comments  deprecated  variants  seed",
+)
+
+
+def transform_args(args):
+    def positive(type_):
+        return schema.And(schema.Use(type_), lambda n: n >= 0)
+
+    fraction = schema.And(schema.Use(float), lambda p: 0 <= p <= 1)
+    return schema.Schema({
+        "--strings": positive(int),
+        "--values": schema.And(schema.Use(int), lambda n: n >= 1),
+        "--placeholders": fraction,
+        "--comments": fraction,
+        "--deprecated": fraction,
+        "--variants": positive(int),
+        "--seed": schema.Use(int),
+        "--repeat": schema.And(schema.Use(int), lambda n: n >= 1),
+        "--tolerance": positive(float),
+        schema.Optional(str): object,
+    }).validate(args)
+
+
+# Generating langfiles.
+
+def make_text(rng, placeholders):
+    words = [rng.choice(WORDS) for _ in range(rng.randint(2, 12))]
+    for i in range(placeholders):
+        words.insert(rng.randint(0, len(words)), "{%d}" % i)
+    if rng.random() < 0.02:
+        words.append("{{%s}}" % rng.choice(WORDS))
+    return " ".join(words)
+
+
+def make_model(rng, params):
+    # Returns a list of `(comment, key, deprecated, gif, values)`.
+    strings = [ ]
+    for i in range(params.strings):
+        key = "Key%05d" % i
+        comment = "Section %d" % i if rng.random() < params.comments else None
+        gif = rng.random() < 0.05
+        placeholders = rng.randint(1, 3) if rng.random() < params.placeholders else 0
+        values = [
+            make_text(rng, placeholders) for _ in range(rng.randint(1, params.values))
+        ]
+        if rng.random() < params.deprecated / 2:
+            # Only a deprecated version.
+            strings.append((comment, key, True, gif, values))
+            continue
+        strings.append((comment, key, False, gif, values))
+        if rng.random() < params.deprecated:
+            strings.append((None, key, True, False, [make_text(rng, placeholders)]))
+    return strings
+
+
+def derive(rng, strings, keep, change):
+    # Drop some strings, swap some neighbours, and retranslate some values.
+    result = [
+        (comment, key, deprecated, gif, [
+            make_text(rng, value.count("{") - value.count("{{") * 2)
+            if rng.random() < change else value
+            for value in values
+        ])
+        for comment, key, deprecated, gif, values in strings
+        if rng.random() < keep
+    ]
+    for i in range(len(result) - 1):
+        # Keep a deprecated duplicate after its string.
+        if rng.random() < 0.05 and result[i][1] != result[i + 1][1]:
+            result[i], result[i + 1] = result[i + 1], result[i]
+    return result
+
+
+def write_langfile(filename, name, base, variant, strings):
+    lines = [
+        '<?xml version="1.0" encoding="utf-8"?>',
+        "<strings>",
+        '  <language name="%s" base="%s" variant="%s" isDefault="%s" />' % (
+            name, base, variant, "true" if name == base else "false",
+        ),
+    ]
+    for comment, key, deprecated, gif, values in strings:
+        if comment is not None:
+            lines.append("  <!-- %s -->" % comment)
+        attributes = ' key="%s"' % key
+        if deprecated:
+            attributes += ' deprecated="true"'
+        if gif:
+            attributes += ' isgif="true"'
+        lines.append("  <string%s>" % attributes)
+        lines.extend("    <value>%s</value>" % value for value in values)
+        lines.append("  </string>")
+    lines.append("</strings>\n")
+    with open(filename, "wb") as f:
+        f.write("\n".join(lines).encode("utf-8"))
+
+
+def generate(directory, params):
+    # Returns filenames of the model, the base, and the variants.
+    rng = random.Random(params.seed)
+    model = make_model(rng, params)
+    base = derive(rng, model, keep=0.95, change=1.0)
+    filenames = [os.path.join(directory, "English.xml"), os.path.join(directory, "Russian.xml")]
+    write_langfile(filenames[0], "English", "English", "Standard", model)
+    write_langfile(filenames[1], "Russian", "Russian", "Standard", base)
+    for i in range(params.variants):
+        filenames.append(os.path.join(directory, "RussianVariant%d.xml" % i))
+        write_langfile(
+            filenames[-1], "Russian %d" % i, "Russian", "Variant%d" % i,
+            derive(rng, base, keep=0.8, change=0.3),
+        )
+    return filenames
+
+
+# Measuring.
+
+@contextlib.contextmanager
+def measure(timings, phase):
+    start = timer()
+    yield
+    timings[phase] += timer() - start
+
+
+def run_once(filenames):
+    timings = collections.Counter()
+    tgwwlang.set_collector(tgwwlang.AnnotationCollector())
+    # Each run should start cold, like a separate invocation of the tool does.
+    tgwwlang.g_placeholder_cache.clear()
+
+    with measure(timings, "load_language"):
+        model = tgwwlang.load_language(FileID.MODEL, filenames[0])
+        base = tgwwlang.load_language(FileID.BASE, filenames[1])
+        targets = [tgwwlang.load_language(FileID.TARGET, f) for f in filenames[2:]]
+    with measure(timings, "scan_language"):
+        for filename in filenames[2:]:
+            tgwwlang.scan_language(FileID.TARGET, filename)
+    with measure(timings, "check_mixed_content"):
+        for lang in targets:
+            tgwwlang.check_mixed_content(FileID.TARGET, lang.dom.getroot())
+    with measure(timings, "check_available_strings"):
+        for lang in targets:
+            tgwwlang.check_available_strings(FileID.TARGET, lang, model)
+    with measure(timings, "check_missing_strings"):
+        for lang in targets:
+            tgwwlang.check_missing_strings(FileID.TARGET, lang, model)
+    with measure(timings, "check_values"):
+        for lang in targets:
+            tgwwlang.check_values(FileID.TARGET, lang, model)
+    with measure(timings, "move_comments"):
+        for lang in targets:
+            tgwwlang.move_comments(lang.dom.getroot())
+    with measure(timings, "modify_strings"):
+        for lang in targets:
+            tgwwlang.modify_strings(lang, base, model, reorder=True, add_missing=True, only=None)
+    indentation = tgwwlang.parse_indentation_spec("2")
+    with measure(timings, "reformat"):
+        for lang in targets:
+            tgwwlang.reformat(lang.dom.getroot(), *indentation)
+    with measure(timings, "serialize"):
+        for lang in targets:
+            tgwwlang.write_language(lang.dom, io.BytesIO(), *indentation)
+    return timings
+
+
+def run(filenames, repeat):
+    tgwwlang.load_xml_schema()
+    samples = collections.defaultdict(list)
+    for _ in range(repeat):
+        for phase, seconds in run_once(filenames).items():
+            samples[phase].append(seconds)
+    return collections.OrderedDict(
+        (phase, {
+            "min": min(samples[phase]),
+            "median": sorted(samples[phase])[len(samples[phase]) // 2],
+        })
+        for phase in PHASES
+    )
+
+
+def measure_memory(filenames):
+    # Returns `{loader: bytes retained per langfile}`, or `{}` if memory cannot be measured.
+    if tracemalloc is None:
+        return { }
+    tgwwlang.set_collector(tgwwlang.AnnotationCollector())
+    # The model is kept alive, as it is when checking langfiles against it.
+    model = tgwwlang.scan_language(FileID.MODEL, filenames[0])
+    result = collections.OrderedDict()
+    for name, load in [
+        ("scan_language", tgwwlang.scan_language),
+        ("load_language", tgwwlang.load_language),
+    ]:
+        gc.collect()
+        tracemalloc.start()
+        try:
+            start = tracemalloc.get_traced_memory()[0]
+            langs = [load(FileID.TARGET, f) for f in filenames[1:]]
+            gc.collect()
+            result[name] = (tracemalloc.get_traced_memory()[0] - start) // len(langs)
+        finally:
+            tracemalloc.stop()
+        del langs
+    del model
+    return result
+
+
+def parse_importtime(output):
+    # Returns the time spent on imports, in seconds, and the set of imported modules.
+    total = 0
+    modules = set()
+    for line in output.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        fields = line[len("import time:"):].split("|")
+        if len(fields) != 3 or not fields[1].strip().isdigit():
+            continue # The header.
+        name = fields[2][1:]
+        modules.add(name.strip())
+        # Nested imports are indented; their time is included in the outer ones.
+        if not name.startswith(" "):
+            total += int(fields[1])
+    return total / 1e6, modules
+
+
+def measure_startup(filenames, repeat):
+    # Returns `({command: seconds}, [(command, forbidden module it imports)])`, or nothing
+    # if `-X importtime` is not supported (before Python 3.7).
+    if sys.version_info < (3, 7):
+        return { }, [ ]
+    import subprocess
+
+    script = os.path.join(os.path.dirname(os.path.abspath(tgwwlang.__file__)), "tgwwlang.py")
+    directory = os.path.dirname(filenames[0])
+    substitutions = {
+        "model": filenames[0],
+        "target": filenames[-1],
+        "socket": os.path.join(directory, "nonexistent.sock"),
+    }
+    timings = collections.OrderedDict()
+    violations = [ ]
+    for name, argv in STARTUP_COMMANDS.items():
+        argv = [arg.format(**substitutions) for arg in argv]
+        samples = [ ]
+        for _ in range(repeat):
+            process = subprocess.Popen(
+                [sys.executable, "-X", "importtime", script] + argv,
+                stdout=subprocess.PIPE, stderr=subprocess.PIPE, cwd=directory,
+            )
+            _, output = process.communicate()
+            seconds, modules = parse_importtime(output.decode("utf-8", "replace"))
+            samples.append(seconds)
+        timings[name] = min(samples)
+        if name in ("-h", "-V"):
+            violations.extend((name, module) for module in STARTUP_FORBIDDEN if module in modules)
+    return timings, violations
+
+
+# Reporting.
+
+def compare(measurements, baseline, tolerance):
+    # Returns a list of `(name, value, baseline value or None, is regression)`.
+    result = [ ]
+    for name, value in measurements.items():
+        old = baseline.get(name)
+        if old is None:
+            result.append((name, value, None, False))
+        else:
+            result.append((name, value, old, value > old * (1 + tolerance / 100)))
+    return result
+
+
+def print_report(comparison, unit, scale, stream):
+    for name, value, old, regression in comparison:
+        line = "%-24s %10.2f %s" % (name, value * scale, unit)
+        if old is not None:
+            line += "  (baseline %.2f %s, %+.1f%%)" % (
+                old * scale, unit, (value / old - 1) * 100 if old else 0,
+            )
+            if regression:
+                line += "  REGRESSION"
+        print(line, file=stream)
+
+
+def main():
+    try:
+        args = transform_args(docopt.docopt(__doc__))
+    except (docopt.DocoptExit, schema.SchemaError) as e:
+        print(tgwwlang.stringify(e), file=sys.stderr)
+        sys.exit(2)
+
+    params = Parameters(
+        strings=args["--strings"],
+        values=args["--values"],
+        placeholders=args["--placeholders"],
+        comments=args["--comments"],
+        deprecated=args["--deprecated"],
+        variants=args["--variants"],
+        seed=args["--seed"],
+    )
+    directory = args["--dir"] or tempfile.mkdtemp(prefix="tgwwlang-benchmark-")
+    try:
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        filenames = generate(directory, params)
+        phases = run(filenames, args["--repeat"])
+        memory = measure_memory(filenames)
+        startup, violations = measure_startup(filenames, args["--repeat"])
+    finally:
+        if args["--dir"] is None:
+            shutil.rmtree(directory, ignore_errors=True)
+
+    baseline = {"phases": { }, "memory": { }, "startup": { }}
+    if args["--baseline"] is not None:
+        with open(args["--baseline"]) as f:
+            baseline.update(json.load(f))
+    comparison = compare(
+        {phase: timing["min"] for phase, timing in phases.items()},
+        {phase: timing["min"] for phase, timing in baseline["phases"].items()},
+        args["--tolerance"],
+    )
+    print_report(comparison, "ms", 1000, sys.stdout)
+    if memory:
+        print(file=sys.stdout)
+        print("Memory per langfile:", file=sys.stdout)
+        memory_comparison = compare(memory, baseline["memory"], args["--tolerance"])
+        print_report(memory_comparison, "KiB", 1 / 1024, sys.stdout)
+        comparison += memory_comparison
+    if startup:
+        print(file=sys.stdout)
+        print("Import time at startup:", file=sys.stdout)
+        startup_comparison = compare(startup, baseline["startup"], args["--tolerance"])
+        print_report(startup_comparison, "ms", 1000, sys.stdout)
+        comparison += startup_comparison
+        for name, module in violations:
+            print("`%s` imports %s  REGRESSION" % (name, module), file=sys.stdout)
+
+    if args["--output"] is not None:
+        with open(args["--output"], "w") as f:
+            json.dump(collections.OrderedDict([
+                ("version", tgwwlang.__version__),
+                ("python", platform.python_version()),
+                ("lxml", ".".join(map(str, etree.LXML_VERSION))),
+                ("parameters", params._asdict()),
+                ("phases", phases),
+                ("memory", memory),
+                ("startup", startup),
+            ]), f, indent=2)
+            f.write("\n")
+
+    sys.exit(bool(violations) or any(regression for _, _, _, regression in comparison))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+# coding: utf-8
+from __future__ import unicode_literals
+
+import io
+import os
+import shutil
+import tempfile
+import unittest
+
+import tgwwlang
+
+
+def make_langfile(name, base, variant, strings, default=False):
+    return "\n".join(
+        [
+            '<?xml version="1.0" encoding="utf-8"?>',
+            "<strings>",
+            '  <language name="%s" base="%s" variant="%s"%s />' % (
+                name, base, variant, ' isDefault="true"' if default else "",
+            ),
+        ] + [
+            '  <string key="%s">\n    <value>%s</value>\n  </string>' % (key, text)
+            for key, text in strings
+        ] + ["</strings>", ""]
+    )
+
+
+class SuggestFromTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        os.mkdir(self.path("memory"))
+        self.write("English.xml", make_langfile(
+            "English", "English", "Standard", [("Hello", "Hello, {0}!")], default=True,
+        ))
+        self.write("Russian.xml", make_langfile(
+            "Русский", "Russian", "Standard",
+            [("Hello", "Привет, {0}!"), ("Unknown", "Неизвестно")],
+        ))
+        self.write("RussianKids.xml", make_langfile(
+            "Русский Детский", "Russian", "Kids", [ ],
+        ))
+        self.write(os.path.join("memory", "RussianOld.xml"), make_langfile(
+            "Русский Старый", "Russian", "Old",
+            [
+                ("Hello", "Здравствуй, {0}!"),
+                ("Unknown", "Неведомо"),
+            ],
+        ))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def path(self, name):
+        return os.path.join(self.directory, name)
+
+    def write(self, name, text):
+        with io.open(self.path(name), "w", encoding="utf-8") as f:
+            f.write(text)
+
+    def update(self, only):
+        return tgwwlang.update(
+            self.path("RussianKids.xml"),
+            model=self.path("English.xml"),
+            base=self.path("Russian.xml"),
+            add_missing=True,
+            only=only,
+            suggest_from=self.path("memory"),
+            backup=False,
+        )
+
+    def get_messages(self, result):
+        return [
+            (code, details)
+            for code, _, details in result.collector.messages[tgwwlang.FileID.TARGET]
+        ]
+
+    def test_fills_string_from_memory(self):
+        result = self.update(["Hello"])
+        self.assertTrue(result.success)
+        self.assertIn(
+            (tgwwlang.MessageCode.SUGGESTED_STRING, ("Hello", self.path(
+                os.path.join("memory", "RussianOld.xml"),
+            ), "Hello")),
+            self.get_messages(result),
+        )
+
+    def test_escapes_dashes_in_comment(self):
+        # The comment names the langfile the translation comes from.
+        os.rename(
+            self.path(os.path.join("memory", "RussianOld.xml")),
+            self.path(os.path.join("memory", "Russian---Old.xml")),
+        )
+        result = self.update(["Hello"])
+        self.assertTrue(result.success)
+        with io.open(self.path("RussianKids.xml"), encoding="utf-8") as f:
+            self.assertIn("<!-- Suggested from Russian- - -Old.xml -->", f.read())
+
+    def test_copies_string_unknown_to_model(self):
+        # The base has a string that the model does not, so there is nothing to suggest from.
+        result = self.update(["Unknown"])
+        self.assertTrue(result.success)
+        self.assertIn(
+            (tgwwlang.MessageCode.ADDED_STRING, ("Unknown", )), self.get_messages(result),
+        )
+        with io.open(self.path("RussianKids.xml"), encoding="utf-8") as f:
+            self.assertIn("Неизвестно", f.read())
+
+
+if __name__ == "__main__":
+    unittest.main()
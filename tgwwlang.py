@@ -27,16 +27,34 @@
 """
 Usage:
     tgwwlang.py check
-        [--model <langfile>]
-        [--json] [--report <report-file>]
-        [--] <langfile>
+        [--model <langfile>] [-j <jobs>]
+        [--no-cache | --cache-dir <dir>] [--cache-size <n>]
+        [--changed-since <rev>] [--recover] [--shard <i/N>]
+        [--json] [--report <report-file>] [--socket <path>] [--profile]
+        [--] <langfile>...
     tgwwlang.py update
         [-i <indent>] [--move-comments]
         [--model <langfile>] [--assign-attributes]
-        [(--base <langfile> [(--add-missing [--only <keys>])] [--reorder])]
-        [--no-backup]
-        [--json] [--report <report-file>]
-        [--] <langfile>
+        [(--base <langfile> [(--add-missing [--only <keys>] [--suggest-from <dir>])]
+            [--reorder])]
+        [--no-backup] [-j <jobs>] [--no-cache | --cache-dir <dir>]
+        [--json] [--report <report-file>] [--socket <path>] [--profile]
+        [--] <langfile>...
+    tgwwlang.py model-diff
+        [-j <jobs>] [--no-cache | --cache-dir <dir>]
+        [--json] [--socket <path>]
+        [--] <old-model> <new-model> [<langfile>...]
+    tgwwlang.py coverage
+        [--model <langfile>] [-j <jobs>] [--no-cache | --cache-dir <dir>]
+        [--json | --csv] [--socket <path>]
+        [--] <langfile>...
+    tgwwlang.py compile
+        [--model <langfile>] [-o <dir>] [-j <jobs>]
+        [--no-cache | --cache-dir <dir>] [--cache-size <n>]
+        [--json] [--socket <path>]
+        [--] <langfile>...
+    tgwwlang.py merge-reports [--socket <path>] [--] <shard-report>...
+    tgwwlang.py serve [--socket <path>]
     tgwwlang.py -h
     tgwwlang.py -V
 
@@ -52,36 +70,126 @@ Options:
     --assign-attributes  Copy `<string>` attributes from the model langfile.
     --add-missing        Copy missing strings from the base langfile.
     --only <keys>        Copy only specified strings (comma-separated).
+    --suggest-from <dir>
+                         Fill copied strings with translations of the most
+                         similar English texts from langfiles of the same
+                         language in the directory, where there are any.
     --reorder            Reorder strings to match the base langfile.
     --no-backup          Do not create `.bak` file.
+    -o, --output-dir <dir>
+                         Directory to write compiled langfiles to. [default: .]
+    -j, --jobs <jobs>    Number of worker processes to handle multiple langfiles
+                         with. 0 means the number of CPUs. [default: 0]
+    --cache-dir <dir>    Directory to keep cached data in. Defaults to
+                         `tgwwlang` in the user's cache directory.
+    --no-cache           Do not read or write cached data.
+    --cache-size <n>     Maximum number of entries to keep in the cache; least
+                         recently used ones are evicted. [default: 1000]
+    --changed-since <rev>
+                         Check only langfiles that differ from the git revision,
+                         including untracked ones that git does not ignore.
+                         If the model langfile differs, check all langfiles in
+                         full, but of those that do not differ, report only
+                         messages about strings that changed in the model.
+    --recover            If a langfile is malformed, report all syntax and
+                         structure errors in it, and check whatever is left.
+    --shard <i/N>        Check only the i-th of N disjoint parts of the langfiles
+                         (1 <= i <= N), which are assigned by their paths relative
+                         to the current directory.
     --json               Produce machine-readable output.
+    --csv                Produce a table of model keys by langfiles, in CSV.
     --report <file>      File to write human-readable report to.
+    --socket <path>      Unix socket of the server. Defaults to
+                         `tgwwlang-<uid>.sock` in the temporary directory.
+    --profile            Report time and memory spent on each phase of the work.
+                         Results of previous checks are not reused.
+
+A directory passed as `<langfile>` stands for all `*.xml` files in it, and
+a glob pattern (e.g., `Russian*.xml`) for all files it matches; the model and
+base langfiles are skipped in both cases. When several langfiles are given,
+the model and base are loaded once, and `--json` produces a single document
+with a separate report for each file.
+
+`model-diff` reports strings that were added, removed, (un)deprecated, or had
+their placeholders or `isgif` changed between two versions of the model. For
+each of the given langfiles, it also reports which messages appear and which
+go away with the new model; only the changed strings are checked.
+
+`coverage` reports, for each langfile, which model keys are missing, which keys
+are unknown to the model, and which strings have mismatched placeholders.
+
+`compile` checks langfiles and writes those that pass to `<name>.tgwwl` files,
+which the bot can look strings up in without parsing XML. Every key of the
+model gets the values of the langfile, of the default variant of its base
+language (if it is among the given langfiles), or of the model, whichever has
+the string first. Langfiles that have not changed since the last compilation
+are skipped. Langfiles with the same name in different directories cannot be
+compiled together.
+
+`check --shard` splits a large batch among several machines: run it with the
+same arguments and each `i` from 1 to N, with `--json`, from the same directory
+of the checkout, and pass the outputs to `merge-reports`, which prints the same
+document as a single `check --json` of all langfiles would. Langfiles are named
+in the outputs by their paths relative to that directory.
+
+`serve` starts a server that keeps the XSD and model langfiles loaded between
+runs. While it is running, other commands of the same user pass their work to
+it, unless the script or the XSD has changed since it was started.
 """
 
 from __future__ import print_function
 
+import binascii
 import collections
-import copy
 import os.path
 import re
+import struct
 import sys
+import threading
+import time
+import zlib
 
 try:
     from future_builtins import map, zip
 except ImportError:
     pass
 
-import docopt
-from   lxml import etree
-import schema
+try:
+    perf_counter, process_time = time.perf_counter, time.process_time
+except AttributeError: # Python 2.
+    perf_counter, process_time = time.time, time.clock
+
+
+class LazyModule(object):
+    # Stands for a module until it is used, then imports it and takes its place in the globals.
+    # Short runs (e.g., `-V`, or `check` answered by the server or from the cache) do not need
+    # most of the modules, and importing lxml alone takes longer than the rest of such a run.
+    def __init__(self, name):
+        self._name = name
+
+    def __getattr__(self, attr):
+        import importlib
+
+        module = importlib.import_module(self._name)
+        globals()[self._name.rpartition(".")[2]] = module
+        return getattr(module, attr)
+
+
+docopt = LazyModule("docopt")
+etree = LazyModule("lxml.etree")
+schema = LazyModule("schema")
+tracemalloc = LazyModule("tracemalloc") if sys.version_info >= (3, 4) else None
 
 
 __version__ = "1.0.0"
+# Part of every cache key. Bump it whenever checks or the structure of cached data change, so that
+# entries written by older code are not used.
+CACHE_FORMAT = 2
 
 MODEL_LANGFILE = "English.xml"
 SCHEMA_PATH = "%s/tgwwlang.xsd" % os.path.dirname(os.path.realpath(__file__))
 
-g_xml_schema = None
+g_xml_schema_hash = None
 
 
 class FileID:
@@ -99,6 +207,10 @@ class MessageCode:
     MISSING_PLACEHOLDER = 2
     EXTRA_PLACEHOLDER   = 3
     ADDED_STRING        = 4
+    MODIFIED            = 5
+    UNTRANSLATED_VALUE  = 6
+    DUPLICATE_VALUE     = 7
+    SUGGESTED_STRING    = 8
     # 2-digit codes (rarely used):
     NOT_FOUND                  = 10
     NOT_DEFAULT                = 11
@@ -121,17 +233,48 @@ class Deprecated:
 
 
 LanguageSummary = \
-    collections.namedtuple("LanguageSummary", "name  base  variant  owner  default  dom")
-String = collections.namedtuple("String", "gif  values  dom")
-Value = collections.namedtuple("Value", "placeholders  dom")
+    collections.namedtuple("LanguageSummary", "name  base  variant  owner  default  line  dom")
+String = collections.namedtuple("String", "gif  values  line  dom")
+Value = collections.namedtuple("Value", "placeholders  text  line  dom")
 Language = collections.namedtuple("Language", "filename  summary  strings  deprecated_summary  dom")
 
 
+# DOM-less counterparts of `String` and `Value`, which take less memory. `Language`s loaded
+# without DOM consist of them. They cannot be `_replace`d, though.
+
+class CompactString(object):
+    __slots__ = ("gif", "values", "line")
+    dom = None
+
+    def __init__(self, gif, values, line):
+        self.gif = gif
+        self.values = values # A tuple.
+        self.line = line
+
+
+class CompactValue(object):
+    __slots__ = ("placeholders", "text", "line")
+    dom = None
+
+    def __init__(self, placeholders, text, line):
+        self.placeholders = placeholders
+        self.text = text
+        self.line = line
+
+
+# Dicts preserve insertion order since Python 3.7, and take much less memory than `OrderedDict`.
+if sys.version_info >= (3, 7):
+    CompactOrderedDict = dict
+else:
+    CompactOrderedDict = collections.OrderedDict
+
+
 class AnnotationCollector:
     def __init__(self):
         self.success = True
         self.messages = [[ ], [ ], [ ], [ ]]
         self.errors = [[ ], [ ], [ ], [ ]]
+        self.profile = [ ] # `(phase, fid, wall time, CPU time, peak memory)`, if profiling.
 
     def add_error(self, fid, line, text):
         self.success = False
@@ -140,10 +283,127 @@ class AnnotationCollector:
     def add_message(self, code, fid, line, *details):
         self.messages[fid].append((code, line or 0, details))
 
+    def copy(self):
+        other = AnnotationCollector()
+        other.success = self.success
+        other.messages = [list(messages) for messages in self.messages]
+        other.errors = [list(errors) for errors in self.errors]
+        other.profile = list(self.profile)
+        return other
+
+    def extend(self, other):
+        self.success = self.success and other.success
+        for a, b in zip(self.messages, other.messages):
+            a.extend(b)
+        for a, b in zip(self.errors, other.errors):
+            a.extend(b)
+        self.profile.extend(other.profile)
+
+    def since(self, origin):
+        # Annotations added after this collector was copied from `origin`.
+        other = AnnotationCollector()
+        other.success = self.success
+        other.messages = [a[len(b):] for a, b in zip(self.messages, origin.messages)]
+        other.errors = [a[len(b):] for a, b in zip(self.errors, origin.errors)]
+        other.profile = self.profile[len(origin.profile):]
+        return other
+
+
+class ThreadState(threading.local):
+    # Annotations go to the collector of the current thread. lxml does not allow
+    # to validate documents against the same schema from multiple threads simultaneously.
+    def __init__(self):
+        self.collector = AnnotationCollector()
+        self.xml_schema = None
+        self.phases = None # A stack of `Phase`s, if profiling.
+
+
+g_state = ThreadState()
+
+
+def get_collector():
+    return g_state.collector
+
+
+def set_collector(collector):
+    # Returns the previous collector.
+    previous = g_state.collector
+    g_state.collector = collector
+    return previous
+
+
+def add_error(fid, line, text):
+    g_state.collector.add_error(fid, line, text)
+
+
+def add_message(code, fid, line, *details):
+    g_state.collector.add_message(code, fid, line, *details)
+
+
+class Phase(object):
+    # Measures a part of the work and adds the result to the collector. Phases may be nested;
+    # an outer phase includes everything spent by inner ones.
+    def __init__(self, name, fid):
+        self.name = name
+        self.fid = fid
+        self.memory = None
+        self.peak = None
+
+    def __enter__(self):
+        stack = g_state.phases
+        if tracemalloc is not None and tracemalloc.is_tracing():
+            current, peak = tracemalloc.get_traced_memory()
+            if stack:
+                stack[-1].peak = max(stack[-1].peak, peak)
+            self.memory = self.peak = current
+            tracemalloc.reset_peak()
+        stack.append(self)
+        self.wall = perf_counter()
+        self.cpu = process_time()
+
+    def __exit__(self, *exc_info):
+        wall = perf_counter() - self.wall
+        cpu = process_time() - self.cpu
+        stack = g_state.phases
+        stack.pop()
+        memory = None
+        if self.memory is not None:
+            self.peak = max(self.peak, tracemalloc.get_traced_memory()[1])
+            memory = self.peak - self.memory
+            if stack:
+                stack[-1].peak = max(stack[-1].peak, self.peak)
+            tracemalloc.reset_peak()
+        g_state.collector.profile.append((self.name, self.fid, wall, cpu, memory))
 
-g_collector = AnnotationCollector()
-add_error = g_collector.add_error
-add_message = g_collector.add_message
+
+class NoPhase(object):
+    def __enter__(self):
+        pass
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+NO_PHASE = NoPhase()
+
+
+def phase(name, fid=FileID.NONE):
+    return NO_PHASE if g_state.phases is None else Phase(name, fid)
+
+
+def start_profiling():
+    if g_state.phases is None:
+        g_state.phases = [ ]
+        # `reset_peak` appeared in Python 3.9; memory is not measured with older versions.
+        if hasattr(tracemalloc, "reset_peak") and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+
+def stop_profiling():
+    if g_state.phases is not None:
+        g_state.phases = None
+        if tracemalloc is not None and tracemalloc.is_tracing():
+            tracemalloc.stop()
 
 
 if sys.version_info.major >= 3:
@@ -169,17 +429,86 @@ def parse_csv(s):
     return values
 
 
+def parse_shard_spec(spec):
+    m = re.match(r"([0-9]+)/([0-9]+)\Z", spec)
+    if m is None or not 1 <= int(m.group(1)) <= int(m.group(2)):
+        raise ValueError("Invalid shard: `%s`" % spec)
+    return int(m.group(1)), int(m.group(2))
+
+
 def transform_args(args):
+    import glob
+
     return schema.Schema({
-        "<langfile>": os.path.isfile,
+        "<langfile>": [schema.Or(os.path.isfile, os.path.isdir, glob.glob)],
+        "<old-model>": schema.Or(None, os.path.isfile),
+        "<new-model>": schema.Or(None, os.path.isfile),
+        "<shard-report>": [os.path.isfile],
         "--indent": schema.Use(parse_indentation_spec),
+        "--jobs": schema.And(schema.Use(int), lambda n: n >= 0),
+        "--cache-size": schema.And(schema.Use(int), lambda n: n >= 0),
         "--model": schema.Or(None, os.path.isfile),
         "--base": schema.Or(None, os.path.isfile),
         "--only": schema.Or(None, schema.Use(parse_csv)),
+        "--suggest-from": schema.Or(None, os.path.isdir),
+        "--cache-dir": schema.Or(None, schema.And(str, len)),
+        "--output-dir": schema.And(str, len),
+        "--socket": schema.Or(None, schema.And(str, len)),
+        "--changed-since": schema.Or(None, schema.And(str, len, lambda rev: rev[0] != "-")),
+        "--shard": schema.Or(None, schema.Use(parse_shard_spec)),
         str: object,
     }).validate(args)
 
 
+def expand_langfiles(paths, references):
+    # Directories and glob patterns are replaced with langfiles they stand for, except
+    # the reference ones (model and base).
+    import glob
+
+    references = {os.path.realpath(filename) for filename in references if filename}
+    filenames = [ ]
+    seen = set()
+    for path in paths:
+        if os.path.isfile(path):
+            found = [path]
+        else:
+            if os.path.isdir(path):
+                path = os.path.join(path, "*.xml")
+            found = [
+                filename for filename in sorted(glob.glob(path))
+                if os.path.isfile(filename) and os.path.realpath(filename) not in references
+            ]
+        # A langfile given more than once is handled once (e.g., not by two workers at the same
+        # time), under the name it is given first.
+        for filename in found:
+            realpath = os.path.realpath(filename)
+            if realpath not in seen:
+                seen.add(realpath)
+                filenames.append(filename)
+    return filenames
+
+
+def select_cache_dir(args):
+    if args["--no-cache"]:
+        return None
+    if args["--cache-dir"] is not None:
+        return args["--cache-dir"]
+    root = (
+        os.environ.get("XDG_CACHE_HOME") or os.environ.get("LOCALAPPDATA") or
+        os.path.join(os.path.expanduser("~"), ".cache")
+    )
+    return os.path.join(root, "tgwwlang")
+
+
+def select_socket(args):
+    import tempfile
+
+    if args["--socket"] is not None:
+        return args["--socket"]
+    uid = os.getuid() if hasattr(os, "getuid") else 0
+    return os.path.join(tempfile.gettempdir(), "tgwwlang-%s.sock" % uid)
+
+
 def select_backup(path):
     prefix, name = os.path.split(path)
     return os.path.join(prefix, ".%s.bak" % name)
@@ -202,109 +531,449 @@ except AttributeError:
         os.rename(src, dst)
 
 
+def hash_file(filename):
+    import hashlib
+
+    h = hashlib.sha1()
+    with open(filename, "rb") as f:
+        for chunk in iter(lambda: f.read(0x10000), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def get_xml_schema_hash():
+    global g_xml_schema_hash
+    if g_xml_schema_hash is None:
+        g_xml_schema_hash = hash_file(SCHEMA_PATH)
+    return g_xml_schema_hash
+
+
+def make_cache_key(*file_hashes):
+    # Cached data becomes invalid when any of the files, the tool, the cache format, or the XSD
+    # changes.
+    import hashlib
+
+    parts = file_hashes + (__version__, str(CACHE_FORMAT), get_xml_schema_hash())
+    return hashlib.sha1("\0".join(part or "" for part in parts).encode("utf-8")).hexdigest()
+
+
+def read_cache(cache_dir, name):
+    import json
+
+    path = os.path.join(cache_dir, name)
+    try:
+        with open(path, "rb") as f:
+            data = json.loads(f.read().decode("utf-8"))
+        # Modification time tells `prune_cache` when the entry was used last.
+        os.utime(path, None)
+    except (IOError, OSError, ValueError):
+        return None
+    return data
+
+
+def have_same_contents(a, b):
+    # Sizes are compared first, so changed files are usually not even read.
+    chunk_size = 0x10000
+    try:
+        if os.path.getsize(a) != os.path.getsize(b):
+            return False
+        with open(a, "rb") as f, open(b, "rb") as g:
+            while True:
+                chunk = f.read(chunk_size)
+                if chunk != g.read(chunk_size):
+                    return False
+                if not chunk:
+                    return True
+    except (IOError, OSError):
+        return False
+
+
+def make_temp_file(filename):
+    # Returns a binary file object and its name. The file is created next to `filename`,
+    # so that it can replace it.
+    import tempfile
+
+    fd, temp = tempfile.mkstemp(prefix=".", suffix=".tmp", dir=os.path.dirname(filename) or ".")
+    return os.fdopen(fd, "wb"), temp
+
+
+def write_file(filename, data, mode=None):
+    # Writes to a temporary file first, so that concurrent readers never see partial data.
+    # The file is accessible only to its owner unless `mode` says otherwise.
+    f, temp = make_temp_file(filename)
+    try:
+        with f:
+            f.write(data)
+        if mode is not None:
+            os.chmod(temp, mode)
+        replace_file(temp, filename)
+    except BaseException:
+        os.remove(temp)
+        raise
+
+
+def update_file(filename, write, backup):
+    # Lets `write` fill a temporary file, which then replaces `filename` unless their contents
+    # are the same. Returns whether `filename` was replaced.
+    f, temp = make_temp_file(filename)
+    try:
+        with f:
+            write(f)
+            f.flush()
+            modified = not have_same_contents(filename, temp)
+            if modified:
+                os.fsync(f.fileno())
+        if not modified:
+            os.remove(temp)
+            return False
+
+        import shutil
+
+        shutil.copymode(filename, temp)
+        if backup:
+            shutil.copy2(filename, select_backup(filename))
+        replace_file(temp, filename)
+    except BaseException:
+        if os.path.exists(temp):
+            os.remove(temp)
+        raise
+    return True
+
+
+def write_cache(cache_dir, name, data):
+    import json
+
+    # The cache is an optimization, so failing to update it is not an error.
+    try:
+        try:
+            os.makedirs(cache_dir)
+        except OSError:
+            if not os.path.isdir(cache_dir):
+                raise
+        write_file(
+            os.path.join(cache_dir, name),
+            json.dumps(data, ensure_ascii=False, separators=(',', ':')).encode("utf-8"),
+        )
+    except (IOError, OSError):
+        pass
+
+
+def prune_cache(cache_dir, limit):
+    entries = [ ]
+    try:
+        names = os.listdir(cache_dir)
+    except OSError:
+        return
+    for name in names:
+        if name.endswith(".json"):
+            path = os.path.join(cache_dir, name)
+            try:
+                entries.append((os.path.getmtime(path), path))
+            except OSError:
+                pass # Removed by a concurrent process.
+    entries.sort()
+    for _, path in entries[:max(len(entries) - limit, 0)]:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+# Compiling the XSD in multiple threads at once occasionally fails.
+g_xml_schema_lock = threading.Lock()
+
+
 def load_xml_schema():
-    global g_xml_schema
-    g_xml_schema = etree.XMLSchema(etree.parse(SCHEMA_PATH))
+    if g_state.xml_schema is None:
+        with g_xml_schema_lock:
+            g_state.xml_schema = etree.XMLSchema(etree.parse(SCHEMA_PATH))
+    return g_state.xml_schema
 
 
 def is_true(value):
     return value == "true"
 
 
-def report_non_blank(fid, cur_line, text):
+def report_non_blank(report, cur_line, text):
     non_space_pos = -len(text.lstrip())
     blank_lines_prefix = text.count('\n', 0, non_space_pos)
-    add_message(MessageCode.DANGLING_TEXT, fid, cur_line + blank_lines_prefix)
+    report(cur_line + blank_lines_prefix)
     return blank_lines_prefix + text.count('\n', non_space_pos)
 
 
-def check_mixed_content(fid, root):
-    def recurse(node, cur_line):
-        cur_line = node.sourceline or cur_line
-        text = node.text
-        if text and node.tag is not etree.Comment:
-            if node.tag != "value" and not text.isspace():
-                cur_line += report_non_blank(fid, cur_line, text)
-            else:
-                cur_line += text.count('\n')
+def scan_text(report, node, cur_line):
+    text = node.text
+    if text and node.tag is not etree.Comment:
+        if node.tag != "value" and not text.isspace():
+            cur_line += report_non_blank(report, cur_line, text)
+        else:
+            cur_line += text.count('\n')
+    return cur_line
 
-        for next_node in node:
-            cur_line = recurse(next_node, cur_line)
 
-        text = node.tail
-        if text:
-            next_node = node.getparent()
-            if (next_node is None or next_node.tag != "value") and not text.isspace():
-                cur_line += report_non_blank(fid, cur_line, text)
-            else:
-                cur_line += text.count('\n')
+def scan_tail(report, node, cur_line):
+    text = node.tail
+    if text:
+        parent = node.getparent()
+        if (parent is None or parent.tag != "value") and not text.isspace():
+            cur_line += report_non_blank(report, cur_line, text)
+        else:
+            cur_line += text.count('\n')
+    return cur_line
 
-        return cur_line
 
-    recurse(root, 1)
+def scan_subtree(report, node, cur_line):
+    # Everything but the tail.
+    cur_line = scan_text(report, node, node.sourceline or cur_line)
+    for child in node:
+        cur_line = scan_tail(report, child, scan_subtree(report, child, cur_line))
+    return cur_line
 
 
-def load_language(fid, filename):
-    tree = etree.parse(filename)
-    g_xml_schema.assertValid(tree)
-    root = tree.getroot()
-    check_mixed_content(fid, root)
+def check_mixed_content(fid, root):
+    def report(line):
+        add_message(MessageCode.DANGLING_TEXT, fid, line)
 
-    lang = root.find("language")
+    scan_tail(report, root, scan_subtree(report, root, 1))
+
+
+def extract_summary(fid, lang, report, keep_dom):
     summary = LanguageSummary(
         name=lang.get("name"),
         base=lang.get("base"),
         variant=lang.get("variant"),
         owner=lang.get("owner") or "",
         default=is_true(lang.get("isDefault")),
-        dom=lang,
+        line=lang.sourceline,
+        dom=lang if keep_dom else None,
     )
     if not summary.name:
-        add_message(MessageCode.EMPTY_LANGUAGE_ATTRIBUTE, fid, lang.sourceline, "name")
+        report(MessageCode.EMPTY_LANGUAGE_ATTRIBUTE, fid, lang.sourceline, "name")
     if not summary.base:
-        add_message(MessageCode.EMPTY_LANGUAGE_ATTRIBUTE, fid, lang.sourceline, "base")
+        report(MessageCode.EMPTY_LANGUAGE_ATTRIBUTE, fid, lang.sourceline, "base")
     if not summary.variant:
-        add_message(MessageCode.EMPTY_LANGUAGE_ATTRIBUTE, fid, lang.sourceline, "variant")
+        report(MessageCode.EMPTY_LANGUAGE_ATTRIBUTE, fid, lang.sourceline, "variant")
+    return summary
+
+
+def register_string(fid, string, key, deprecated, deprecated_summary, report):
+    cur_status = Deprecated.TRUE if deprecated else Deprecated.FALSE
+    prev_status = deprecated_summary.get(key)
+    if prev_status is not None:
+        # A non-deprecated string followed by a deprecated one is OK, but not vice versa.
+        if cur_status <= prev_status:
+            report(MessageCode.MULTIPLE_DEFINITIONS, fid, string.sourceline, key)
+        if cur_status != prev_status:
+            cur_status = Deprecated.BOTH
+    deprecated_summary[key] = cur_status
+
+
+# `{{` is an escaped brace, not a placeholder.
+PLACEHOLDER_REGEX = re.compile(r"(?<!\{)(?:\{\{)*(\{[^{}]*\})")
+# .NET composite format: `{index[,alignment][:formatString]}`.
+PLACEHOLDER_ITEM_REGEX = re.compile(r"\{\s*(\d+)\s*(?:,\s*(-?\d+)\s*)?(?::(.*))?\}\Z", re.S)
+PLACEHOLDER_CACHE_SIZE = 4096
+
+Placeholder = collections.namedtuple("Placeholder", "index  alignment  format_spec")
+
+NO_PLACEHOLDERS = frozenset()
+
+# The same texts occur in many langfiles, and there are only a few distinct placeholder sets.
+# Sets are interned, so equal sets are usually the same object.
+g_placeholder_sets = {NO_PLACEHOLDERS: NO_PLACEHOLDERS}
+g_placeholder_cache = collections.OrderedDict()
+g_placeholder_lock = threading.Lock()
+# Likewise, `(key, deprecated)` pairs of strings are shared by all langfiles loaded by the process.
+g_string_keys = { }
+g_string_key_lock = threading.Lock()
+
+
+def intern_placeholders(placeholders):
+    placeholders = frozenset(placeholders)
+    with g_placeholder_lock:
+        return g_placeholder_sets.setdefault(placeholders, placeholders)
+
+
+def scan_placeholders(text):
+    if "{" not in text:
+        return NO_PLACEHOLDERS
+    with g_placeholder_lock:
+        placeholders = g_placeholder_cache.pop(text, None)
+        if placeholders is None:
+            placeholders = frozenset(PLACEHOLDER_REGEX.findall(text))
+            placeholders = g_placeholder_sets.setdefault(placeholders, placeholders)
+            if len(g_placeholder_cache) >= PLACEHOLDER_CACHE_SIZE:
+                g_placeholder_cache.popitem(last=False)
+        # Move to the end (most recently used).
+        g_placeholder_cache[text] = placeholders
+    return placeholders
+
+
+def parse_placeholder(placeholder):
+    # Returns `None` if `placeholder` is not a valid format item (e.g., `{name}`).
+    m = PLACEHOLDER_ITEM_REGEX.match(placeholder)
+    if m is None:
+        return None
+    index, alignment, format_spec = m.groups()
+    return Placeholder(
+        index=int(index),
+        alignment=alignment and int(alignment),
+        format_spec=format_spec,
+    )
 
-    strings = collections.OrderedDict()
-    deprecated_summary = collections.OrderedDict()
-    for string in root.iterchildren("string"):
-        key = string.get("key")
-        deprecated = is_true(string.get("deprecated"))
-
-        cur_status = Deprecated.TRUE if deprecated else Deprecated.FALSE
-        prev_status = deprecated_summary.get(key)
-        if prev_status is not None:
-            # A non-deprecated string followed by a deprecated one is OK, but not vice versa.
-            if cur_status <= prev_status:
-                add_message(MessageCode.MULTIPLE_DEFINITIONS, fid, string.sourceline, key)
-            if cur_status != prev_status:
-                cur_status = Deprecated.BOTH
-        deprecated_summary[key] = cur_status
-
-        # Check that `<value>`s are present and non-empty.
-        values = [ ]
-        for value in string.iterchildren("value"):
-            text = (value.text or "") + "".join(
-                child.tail for child in value if child.tail is not None
-            )
-            if not text:
-                add_message(MessageCode.EMPTY_VALUE, fid, value.sourceline, key)
-            values.append(Value(
-                placeholders=frozenset(
-                    m.group(1)
-                    for m in re.finditer(r"(?<!\{)(?:\{\{)*(\{[^{}]*\})", text)
-                ),
-                dom=value,
-            ))
-        if not values:
-            add_message(MessageCode.NO_VALUES, fid, string.sourceline, key)
 
-        strings.setdefault((key, deprecated), String(
-            gif=is_true(string.get("isgif")),
-            values=values,
-            dom=string,
-        ))
+def intern_string_key(key, deprecated):
+    string_key = key, deprecated
+    with g_string_key_lock:
+        return g_string_keys.setdefault(string_key, string_key)
+
+
+def make_value(fid, key, value, text, report, keep_dom):
+    if not text:
+        report(MessageCode.EMPTY_VALUE, fid, value.sourceline, key)
+    if not keep_dom:
+        return CompactValue(scan_placeholders(text), text, value.sourceline)
+    return Value(
+        placeholders=scan_placeholders(text),
+        text=text,
+        line=value.sourceline,
+        dom=value,
+    )
+
+
+def add_string(fid, string, key, deprecated, values, strings, report, keep_dom):
+    if not values:
+        report(MessageCode.NO_VALUES, fid, string.sourceline, key)
+    if not keep_dom:
+        strings.setdefault(
+            intern_string_key(key, deprecated),
+            CompactString(is_true(string.get("isgif")), tuple(values), string.sourceline),
+        )
+        return
+    strings.setdefault((key, deprecated), String(
+        gif=is_true(string.get("isgif")),
+        values=values,
+        line=string.sourceline,
+        dom=string,
+    ))
+
+
+def extract_string(fid, string, strings, deprecated_summary, report, keep_dom):
+    key = string.get("key")
+    deprecated = is_true(string.get("deprecated"))
+    if not keep_dom:
+        key = intern_string_key(key, deprecated)[0]
+    register_string(fid, string, key, deprecated, deprecated_summary, report)
+    # Check that `<value>`s are present and non-empty.
+    values = [
+        make_value(fid, key, value, (value.text or "") + "".join(
+            child.tail for child in value if child.tail is not None
+        ), report, keep_dom)
+        for value in string.iterchildren("value")
+    ]
+    add_string(fid, string, key, deprecated, values, strings, report, keep_dom)
+
+
+LANGUAGE_ATTRIBUTES = frozenset(["name", "base", "variant", "owner", "code", "isDefault"])
+STRING_ATTRIBUTES = frozenset(["key", "deprecated", "isgif"])
+
+
+def has_valid_attributes(node, allowed, required, booleans):
+    attrib = node.attrib
+    return (
+        allowed.issuperset(attrib) and all(name in attrib for name in required) and
+        all(attrib.get(name, "true") in ("true", "false") for name in booleans)
+    )
+
+
+def fuse_language(fid, root):
+    # Does the job of `XMLSchema.assertValid`, `check_mixed_content`, and data extraction
+    # in a single non-recursive pass. Only a subset of valid langfiles is recognized (without
+    # processing instructions, etc.); `None` is returned for anything else, and nothing is
+    # reported then, so that the caller can fall back to the XSD.
+    Comment = etree.Comment
+    dangling = [ ]
+    messages = [ ]
+    report_dangling = dangling.append
+    report = lambda *args: messages.append(args)
+    summary = None
+    strings = CompactOrderedDict()
+    deprecated_summary = CompactOrderedDict()
+
+    if root.tag != "strings" or root.attrib:
+        return None
+    cur_line = scan_text(report_dangling, root, root.sourceline or 1)
+    for node in root:
+        tag = node.tag
+        cur_line = node.sourceline or cur_line
+        if tag is Comment:
+            pass
+        elif tag == "string" and summary is not None:
+            if not has_valid_attributes(
+                node, STRING_ATTRIBUTES, ("key", ), ("deprecated", "isgif"),
+            ):
+                return None
+            key = node.get("key")
+            deprecated = is_true(node.get("deprecated"))
+            register_string(fid, node, key, deprecated, deprecated_summary, report)
+            values = [ ]
+            cur_line = scan_text(report_dangling, node, cur_line)
+            for value in node:
+                cur_line = value.sourceline or cur_line
+                if value.tag == "value":
+                    if value.attrib:
+                        return None
+                    text = value.text or ""
+                    cur_line += text.count('\n')
+                    for child in value:
+                        if child.tag is not Comment:
+                            return None
+                        cur_line = child.sourceline or cur_line
+                        if child.tail is not None:
+                            text += child.tail
+                            cur_line += child.tail.count('\n')
+                    values.append(make_value(fid, key, value, text, report, True))
+                elif value.tag is not Comment:
+                    return None
+                cur_line = scan_tail(report_dangling, value, cur_line)
+            add_string(fid, node, key, deprecated, values, strings, report, True)
+        elif tag == "language" and summary is None:
+            if node.text is not None or len(node) or not has_valid_attributes(
+                node, LANGUAGE_ATTRIBUTES, ("name", "base", "variant"), ("isDefault", ),
+            ):
+                return None
+            summary = extract_summary(fid, node, report, True)
+        else:
+            return None
+        cur_line = scan_tail(report_dangling, node, cur_line)
+    if summary is None:
+        return None
+    return summary, strings, deprecated_summary, dangling, messages
+
+
+def load_language(fid, filename):
+    # Forget errors of previously parsed files, so that they are not reported twice.
+    etree.clear_error_log()
+    tree = etree.parse(filename)
+    root = tree.getroot()
+    result = fuse_language(fid, root)
+    if result is not None:
+        summary, strings, deprecated_summary, dangling, messages = result
+        for line in dangling:
+            add_message(MessageCode.DANGLING_TEXT, fid, line)
+        for args in messages:
+            add_message(*args)
+    else:
+        # Either invalid or unusual; let the XSD judge.
+        with phase("validate", fid):
+            load_xml_schema().assertValid(tree)
+        check_mixed_content(fid, root)
+
+        summary = extract_summary(fid, root.find("language"), add_message, True)
+        strings = CompactOrderedDict()
+        deprecated_summary = CompactOrderedDict()
+        for string in root.iterchildren("string"):
+            extract_string(fid, string, strings, deprecated_summary, add_message, True)
 
     return Language(
         filename=filename,
@@ -315,28 +984,218 @@ def load_language(fid, filename):
     )
 
 
+def scan_language(fid, filename):
+    # A DOM-less counterpart of `load_language`. The file is validated while being parsed, and
+    # every child of the root is discarded as soon as it is processed, so memory usage does not
+    # depend on the file size. Annotations are the same (and in the same order) as produced
+    # by `load_language`, which is also used to report errors if the file is invalid.
+    etree.clear_error_log()
+    dangling = [ ]
+    messages = [ ]
+
+    def report_dangling(line):
+        dangling.append(line)
+
+    def report(*args):
+        messages.append(args)
+
+    summary = None
+    strings = CompactOrderedDict()
+    deprecated_summary = CompactOrderedDict()
+    root = None
+    pending = None # The last processed child of the root, whose tail has not been scanned yet.
+    cur_line = 1
+    try:
+        for _, node in etree.iterparse(filename, events=("end", ), schema=load_xml_schema()):
+            parent = node.getparent()
+            if parent is not None and parent.getparent() is not None:
+                continue # Nested nodes are processed along with their `<string>`.
+            if root is None:
+                root = node if parent is None else parent
+                cur_line = scan_text(report_dangling, root, root.sourceline or cur_line)
+
+            # Tails of preceding siblings are complete by now.
+            if node is root:
+                preceding = list(root)
+            else:
+                preceding = [ ]
+                child = node.getprevious()
+                while child is not None:
+                    preceding.append(child)
+                    child = child.getprevious()
+                preceding.reverse()
+            for child in preceding:
+                if child is not pending: # A comment or a processing instruction.
+                    cur_line = scan_subtree(report_dangling, child, cur_line)
+                cur_line = scan_tail(report_dangling, child, cur_line)
+                del root[0]
+            if node is root:
+                continue # Do not `break`: validation completes when the iterator is exhausted.
+
+            cur_line = scan_subtree(report_dangling, node, cur_line)
+            if node.tag == "string":
+                extract_string(fid, node, strings, deprecated_summary, report, False)
+            elif summary is None:
+                summary = extract_summary(fid, node, report, False)
+            pending = node
+    except etree.XMLSyntaxError:
+        return load_language(fid, filename)
+
+    for line in dangling:
+        add_message(MessageCode.DANGLING_TEXT, fid, line)
+    for args in messages:
+        add_message(*args)
+    return Language(
+        filename=filename,
+        summary=summary,
+        strings=strings,
+        deprecated_summary=deprecated_summary,
+        dom=None,
+    )
+
+
 def check_placeholders_sanity(fid, model):
     for (key, _), string in model.strings.items():
         if len({value.placeholders for value in string.values}) > 1:
-            add_message(MessageCode.INCONSISTENT_PLACEHOLDERS, fid, string.dom.sourceline, key)
+            add_message(MessageCode.INCONSISTENT_PLACEHOLDERS, fid, string.line, key)
+
+
+def dump_model_snapshot(lang, messages):
+    return {
+        "summary": list(lang.summary[:-1]),
+        "strings": [
+            [key, deprecated, string.gif, [sorted(value.placeholders) for value in string.values]]
+            for (key, deprecated), string in lang.strings.items()
+        ],
+        "texts": [[value.text for value in string.values] for string in lang.strings.values()],
+        "deprecated": list(lang.deprecated_summary.items()),
+        "messages": messages,
+    }
+
+
+def load_model_snapshot(filename, snapshot):
+    # The result has no DOM; it is enough for validating other langfiles against it.
+    strings = CompactOrderedDict()
+    deprecated_summary = CompactOrderedDict()
+    for (key, deprecated, gif, values), texts in zip(snapshot["strings"], snapshot["texts"]):
+        strings[intern_string_key(key, deprecated)] = CompactString(
+            gif,
+            tuple(
+                CompactValue(intern_placeholders(placeholders), text, 0)
+                for placeholders, text in zip(values, texts)
+            ),
+            0,
+        )
+    for key, deprecated in snapshot["deprecated"]:
+        deprecated_summary[intern_string_key(key, False)[0]] = deprecated
+    lang = Language(
+        filename=filename,
+        summary=LanguageSummary(*snapshot["summary"], dom=None),
+        strings=strings,
+        deprecated_summary=deprecated_summary,
+        dom=None,
+    )
+    for code, line, details in snapshot["messages"]:
+        add_message(code, FileID.MODEL, line, *details)
+    return lang
+
+
+def read_model_language(filename, cache_dir):
+    if cache_dir is not None:
+        cache_name = "model-%s.json" % make_cache_key(hash_file(filename))
+        snapshot = read_cache(cache_dir, cache_name)
+        if snapshot is not None:
+            try:
+                return load_model_snapshot(filename, snapshot)
+            except (KeyError, TypeError, ValueError):
+                pass # Written by an incompatible version.
+
+    messages = get_collector().messages[FileID.MODEL]
+    first_message = len(messages)
+    lang = scan_language(FileID.MODEL, filename)
+    if not lang.summary.default:
+        add_message(MessageCode.NOT_DEFAULT, FileID.MODEL, lang.summary.line)
+    check_placeholders_sanity(FileID.MODEL, lang)
+    if cache_dir is not None:
+        write_cache(cache_dir, cache_name, dump_model_snapshot(lang, messages[first_message:]))
+    return lang
 
 
-def load_model_language(filename):
+# Models loaded by this process: `{realpath: ((mtime, size), model, annotations)}`.
+# Only a long-living process (see `serve`) will typically load the same model twice.
+g_loaded_models = { }
+
+
+def load_model_language(filename, cache_dir=None):
     if filename is None and not os.path.isfile(MODEL_LANGFILE):
         add_message(MessageCode.NOT_FOUND, FileID.MODEL, 0)
         return None
     filename = filename or MODEL_LANGFILE
-    lang = load_language(FileID.MODEL, filename)
-    if not lang.summary.default:
-        add_message(MessageCode.NOT_DEFAULT, FileID.MODEL, lang.summary.dom.sourceline)
-    check_placeholders_sanity(FileID.MODEL, lang)
+    path = os.path.realpath(filename)
+    stat = os.stat(path)
+    stamp = stat.st_mtime, stat.st_size
+    loaded = g_loaded_models.get(path)
+    if loaded is not None and loaded[0] == stamp:
+        for code, line, details in loaded[2]:
+            add_message(code, FileID.MODEL, line, *details)
+        return loaded[1]._replace(filename=filename)
+
+    messages = get_collector().messages[FileID.MODEL]
+    first_message = len(messages)
+    lang = read_model_language(filename, cache_dir)
+    g_loaded_models[path] = stamp, lang, messages[first_message:]
     return lang
 
 
-def load_target_language(filename):
-    lang = load_language(FileID.TARGET, filename)
+def recover_language(fid, filename):
+    # Unlike `load_language`, reports every error instead of raising on the first one, and
+    # extracts whatever strings look fine. Returns `None` if there is no root element.
+    etree.clear_error_log()
+    parser = etree.XMLParser(recover=True)
+    try:
+        tree = etree.parse(filename, parser)
+    except etree.XMLSyntaxError:
+        return None
+    root = tree.getroot()
+    if root is None:
+        return None
+    report_error_log(fid, parser.error_log)
+    xml_schema = load_xml_schema()
+    with phase("validate", fid):
+        if not xml_schema.validate(tree):
+            report_error_log(fid, xml_schema.error_log)
+    check_mixed_content(fid, root)
+
+    lang = root.find("language")
+    if lang is not None:
+        summary = extract_summary(fid, lang, add_message, True)
+    else:
+        summary = LanguageSummary(
+            name=None, base=None, variant=None, owner="", default=False, line=0, dom=None,
+        )
+    strings = CompactOrderedDict()
+    deprecated_summary = CompactOrderedDict()
+    for string in root.iterchildren("string"):
+        if string.get("key") is not None:
+            extract_string(fid, string, strings, deprecated_summary, add_message, True)
+    return Language(
+        filename=filename,
+        summary=summary,
+        strings=strings,
+        deprecated_summary=deprecated_summary,
+        dom=tree,
+    )
+
+
+def load_target_language(filename, keep_dom=True, recover=False):
+    try:
+        lang = (load_language if keep_dom else scan_language)(FileID.TARGET, filename)
+    except (etree.XMLSyntaxError, etree.DocumentInvalid) as e:
+        lang = recover_language(FileID.TARGET, filename) if recover else None
+        if lang is None:
+            raise e
     if lang.summary.owner:
-        add_message(MessageCode.CLOSED, FileID.TARGET, lang.summary.dom.sourceline,
+        add_message(MessageCode.CLOSED, FileID.TARGET, lang.summary.line,
             lang.summary.owner,
         )
     return lang
@@ -346,9 +1205,9 @@ def check_summary(lang, base):
     a = lang.summary
     b = base.summary
     if a.name == b.name:
-        add_message(MessageCode.SAME_LANGUAGE_NAME, FileID.TARGET, a.dom.sourceline, a.name)
+        add_message(MessageCode.SAME_LANGUAGE_NAME, FileID.TARGET, a.line, a.name)
     if (a.base, a.variant) == (b.base, b.variant):
-        add_message(MessageCode.SAME_LANGUAGE_BASE_VARIANT, FileID.TARGET, a.dom.sourceline,
+        add_message(MessageCode.SAME_LANGUAGE_BASE_VARIANT, FileID.TARGET, a.line,
             a.base, a.variant,
         )
 
@@ -358,34 +1217,99 @@ def check_available_strings(fid, lang, model):
         model_deprecated = model.deprecated_summary.get(key)
         # Check if it exists at all.
         if model_deprecated is None:
-            add_message(MessageCode.UNKNOWN_KEY, fid, string.dom.sourceline, key)
+            add_message(MessageCode.UNKNOWN_KEY, fid, string.line, key)
             continue
 
         # Check if it is wrongly deprecated.
         if deprecated and model_deprecated == Deprecated.FALSE:
-            add_message(MessageCode.INVALID_ATTRIBUTE, fid, string.dom.sourceline,
+            add_message(MessageCode.INVALID_ATTRIBUTE, fid, string.line,
                 key, "deprecated",
             )
 
         model_string = model.strings.get((key, deprecated)) or model.strings[key, not deprecated]
         # Check if it has an unneded GIF.
         if string.gif and not model_string.gif:
-            add_message(MessageCode.INVALID_ATTRIBUTE, fid, string.dom.sourceline, key, "isgif")
+            add_message(MessageCode.INVALID_ATTRIBUTE, fid, string.line, key, "isgif")
 
         # Check placeholders.
         if model_string.values:
             model_placeholders = model_string.values[0].placeholders
             for value in string.values:
+                if value.placeholders is model_placeholders:
+                    continue
                 for missing in sorted(model_placeholders - value.placeholders):
-                    add_message(MessageCode.MISSING_PLACEHOLDER, fid, value.dom.sourceline,
+                    add_message(MessageCode.MISSING_PLACEHOLDER, fid, value.line,
                         key, missing,
                     )
                 for extra in sorted(value.placeholders - model_placeholders):
-                    add_message(MessageCode.EXTRA_PLACEHOLDER, fid, value.dom.sourceline,
+                    add_message(MessageCode.EXTRA_PLACEHOLDER, fid, value.line,
                         key, extra,
                     )
 
 
+# Values of the model langfile: `({text: keys}, {key: texts})`. Only the index of the latest
+# model is kept, which is enough for a batch run or a server.
+ValueIndex = collections.namedtuple("ValueIndex", "keys  texts")
+
+LETTER_REGEX = re.compile(r"[^\W\d_]", re.U)
+
+
+def normalize_text(text):
+    # Values that differ only in case and whitespace are considered the same. Returns `None`
+    # for those without letters outside of placeholders (e.g., `{0}: {1}`), which are the same
+    # in any language.
+    if LETTER_REGEX.search(PLACEHOLDER_REGEX.sub("", text) if "{" in text else text) is None:
+        return None
+    return " ".join(text.split()).lower()
+
+g_value_index = None, None
+
+
+def get_value_index(model):
+    global g_value_index
+    strings, index = g_value_index
+    if strings is not model.strings:
+        index = ValueIndex(collections.defaultdict(set), collections.defaultdict(set))
+        for (key, _), string in model.strings.items():
+            # Values of GIF strings are IDs of media, which are the same in any language.
+            if string.gif:
+                continue
+            for value in string.values:
+                text = normalize_text(value.text)
+                if text is not None:
+                    index.keys[text].add(key)
+                    index.texts[key].add(text)
+        g_value_index = model.strings, index
+    return index
+
+
+def check_values(fid, lang, model):
+    index = get_value_index(model)
+    # Langfiles based on the model's language may keep its texts.
+    check_untranslated = lang.summary.base != model.summary.base
+    first_keys = { }
+    for (key, deprecated), string in lang.strings.items():
+        model_string = (
+            model.strings.get((key, deprecated)) or model.strings.get((key, not deprecated))
+        )
+        if string.gif or model_string is not None and model_string.gif:
+            continue
+        for value in string.values:
+            text = normalize_text(value.text)
+            if text is None:
+                continue
+            if key in index.keys.get(text, ()):
+                if check_untranslated:
+                    add_message(MessageCode.UNTRANSLATED_VALUE, fid, value.line, key)
+                continue
+            first_key = first_keys.setdefault(text, key)
+            # Strings that share a value in the model may share it in translations, too.
+            if first_key != key and not any(
+                key in index.keys[model_text] for model_text in index.texts.get(first_key, ())
+            ):
+                add_message(MessageCode.DUPLICATE_VALUE, fid, value.line, key, first_key)
+
+
 def check_missing_strings(fid, lang, model):
     for key, deprecated in model.deprecated_summary.items():
         if deprecated != Deprecated.TRUE and key not in lang.deprecated_summary:
@@ -417,7 +1341,21 @@ def move_comments(root):
         del comments[:]
 
 
-def modify_strings(lang, base, model, reorder, add_missing, only):
+def clone_string(string):
+    # The element is copied once, and `Value`s are mapped onto its children.
+    import copy
+
+    dom = copy.deepcopy(string.dom)
+    return string._replace(
+        values=[
+            value._replace(dom=node)
+            for value, node in zip(string.values, dom.iterchildren("value"))
+        ],
+        dom=dom,
+    )
+
+
+def modify_strings(lang, base, model, reorder, add_missing, only, suggest=None):
     if not reorder and not add_missing:
         return
     root = lang.dom.getroot()
@@ -439,8 +1377,8 @@ def modify_strings(lang, base, model, reorder, add_missing, only):
                 if string is None and model_deprecated != Deprecated.BOTH:
                     string = lang.strings.get((key, not deprecated))
                 if string is None:
-                    add_message(MessageCode.ADDED_STRING, FileID.TARGET, 0, key)
-                    string = lang.strings[key, deprecated] = copy.deepcopy(base_string)
+                    string = lang.strings[key, deprecated] = \
+                        make_missing_string(key, deprecated, base_string, suggest)
                     root.append(string.dom)
                 found |= 1 << deprecated
             assert found != 0x0
@@ -456,6 +1394,9 @@ def modify_strings(lang, base, model, reorder, add_missing, only):
         def should_add(key, deprecated, model_deprecated):
             return key in only
 
+    # Elements to be moved to the end, in order. An element that is met again goes further,
+    # just as repeated `root.append` would do.
+    moved = collections.OrderedDict()
     for (key, deprecated), base_string in base.strings.items():
         model_deprecated = model.deprecated_summary.get(key, Deprecated.TRUE)
         string = lang.strings.get((key, deprecated))
@@ -463,16 +1404,20 @@ def modify_strings(lang, base, model, reorder, add_missing, only):
             string = lang.strings.get((key, not deprecated))
         if string is not None:
             if reorder:
-                root.append(string.dom)
+                moved.pop(string.dom, None)
+                moved[string.dom] = None
         elif add_missing and should_add(key, deprecated, model_deprecated):
-            add_message(MessageCode.ADDED_STRING, FileID.TARGET, 0, key)
-            string = lang.strings[key, deprecated] = copy.deepcopy(base_string)
+            string = lang.strings[key, deprecated] = \
+                make_missing_string(key, deprecated, base_string, suggest)
             lang.deprecated_summary[key] = (
                 Deprecated.BOTH if key in lang.deprecated_summary else
                 Deprecated.TRUE if deprecated else
                 Deprecated.FALSE
             )
-            root.append(string.dom)
+            moved[string.dom] = None
+
+    # Move everything in one call. The rest of the children keep their places.
+    root.extend(moved)
 
 
 def assign_attributes(lang, model):
@@ -485,14 +1430,217 @@ def assign_attributes(lang, model):
             string.dom.set("deprecated", "true")
             if lang.deprecated_summary[key] == Deprecated.BOTH:
                 # Now both `<string>`s are deprecated, which is illegal.
-                add_message(MessageCode.MULTIPLE_DEFINITIONS, FileID.TARGET, string.sourceline, key)
+                add_message(MessageCode.MULTIPLE_DEFINITIONS, FileID.TARGET, string.line, key)
         if (model.strings.get((key, deprecated)) or model.strings[key, not deprecated]).gif:
             string.dom.set("isgif", "true")
 
+# Translation memory for `--suggest-from`. A string added to a langfile gets the translation of
+# the most similar English text found in langfiles of the same language. English texts of
+# the model are indexed by character trigrams, so that only texts sharing a trigram with
+# the query are compared with it. Both the index and the translations of each langfile are kept
+# in the cache.
+
+# `strings` maps keys to lists of values; deprecated strings are out of date, so they are left out.
+MemorySource = collections.namedtuple("MemorySource", "filename  base  strings")
+# `texts[i]` is the normalized English text of `keys[i]` (or `None`), `sizes[i]` is the number
+# of its trigrams, and `trigrams` maps each trigram to indices of the texts that have it.
+MemoryIndex = collections.namedtuple("MemoryIndex", "keys  ids  texts  sizes  trigrams")
+
+# Minimal similarity (Sørensen–Dice coefficient over trigrams) of English texts for
+# the translation of one to be suggested for the other.
+SUGGESTION_THRESHOLD = 0.7
+
+g_memory_index = None, None
+
+
+def make_trigrams(text):
+    text = " %s " % text
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+def build_memory_index(model):
+    keys = list(model.deprecated_summary)
+    texts = [ ]
+    sizes = [ ]
+    trigrams = collections.defaultdict(list)
+    for i, key in enumerate(keys):
+        string = model.strings.get((key, False)) or model.strings[key, True]
+        text = normalize_text(string.values[0].text) if string.values else None
+        texts.append(text)
+        text_trigrams = make_trigrams(text) if text is not None else ()
+        sizes.append(len(text_trigrams))
+        for trigram in text_trigrams:
+            trigrams[trigram].append(i)
+    return {"keys": keys, "texts": texts, "sizes": sizes, "trigrams": trigrams}
+
+
+def get_memory_index(model, cache_dir):
+    global g_memory_index
+    strings, index = g_memory_index
+    if strings is model.strings:
+        return index
+    name = data = None
+    if cache_dir is not None and os.path.isfile(model.filename):
+        name = "memory-index-%s.json" % make_cache_key(hash_file(model.filename))
+        data = read_cache(cache_dir, name)
+    if data is None:
+        data = build_memory_index(model)
+        if name is not None:
+            write_cache(cache_dir, name, data)
+    index = MemoryIndex(
+        keys=data["keys"],
+        ids={key: i for i, key in enumerate(data["keys"])},
+        texts=data["texts"],
+        sizes=data["sizes"],
+        trigrams=data["trigrams"],
+    )
+    g_memory_index = model.strings, index
+    return index
+
+
+def read_memory_source(filename, cache_dir):
+    name = "memory-%s.json" % make_cache_key(hash_file(filename))
+    data = read_cache(cache_dir, name) if cache_dir is not None else None
+    if data is None:
+        try:
+            lang = collect(scan_language, FileID.TARGET, filename).language
+        except (etree.XMLSyntaxError, etree.DocumentInvalid):
+            lang = None
+        data = {"base": None, "strings": { }} if lang is None else {
+            "base": lang.summary.base,
+            "strings": {
+                key: [value.text for value in string.values]
+                for (key, deprecated), string in lang.strings.items()
+                if not deprecated and string.values
+            },
+        }
+        if cache_dir is not None:
+            write_cache(cache_dir, name, data)
+    return MemorySource(filename, data["base"], data["strings"])
+
+
+def load_translation_memory(directory, cache_dir):
+    return tuple(
+        read_memory_source(filename, cache_dir) for filename in expand_langfiles([directory], [ ])
+    )
 
-def reformat(root, flat, indentation):
+
+def rank_memory_sources(memory, lang):
+    # Only langfiles of the same language are useful. The langfile itself goes first, then
+    # the others, starting with those that share the most translations with it.
+    own = {
+        key: [value.text for value in string.values]
+        for (key, deprecated), string in lang.strings.items()
+        if not deprecated and string.values
+    }
+    target = os.path.realpath(lang.filename)
+    others = [
+        source for source in memory
+        if source.base == lang.summary.base and os.path.realpath(source.filename) != target
+    ]
+    others.sort(key=lambda source: (
+        -sum(source.strings.get(key) == values for key, values in own.items()), source.filename,
+    ))
+    return [MemorySource(lang.filename, lang.summary.base, own)] + others
+
+
+def suggest_translation(index, trigrams, sources, model, key):
+    # Returns `(values, filename, key, similarity)` of the best translation, or `None`.
+    # `trigrams` replaces `index.trigrams`.
+    model_string = model.strings.get((key, False)) or model.strings.get((key, True))
+    # Strings that only the base has (e.g., added with `--only`) are copied as they are.
+    if model_string is None:
+        return None
+    allowed = {value.placeholders for value in model_string.values}
+
+    def find(source_key):
+        for source in sources:
+            values = source.strings.get(source_key)
+            if values is not None and all(scan_placeholders(value) in allowed for value in values):
+                return values, source.filename
+        return None
+
+    # The same key is the best match.
+    found = find(key)
+    if found is not None:
+        return found + (key, 1.0)
+    i = index.ids.get(key)
+    if i is None or index.texts[i] is None:
+        return None
+    query = make_trigrams(index.texts[i])
+    shared = collections.Counter()
+    for trigram in query:
+        shared.update(trigrams.get(trigram, ()))
+    candidates = [ ]
+    for j, n in shared.items():
+        similarity = 2.0 * n / (len(query) + index.sizes[j])
+        if similarity >= SUGGESTION_THRESHOLD and j != i:
+            candidates.append((-similarity, j))
+    for similarity, j in sorted(candidates):
+        found = find(index.keys[j])
+        if found is not None:
+            return found + (index.keys[j], -similarity)
+    return None
+
+
+def make_suggester(args, lang, model):
+    # Returns a function that takes a key and returns `suggest_translation`'s result.
+    cache_dir = select_cache_dir(args)
+    memory = args["--suggest-from"]
+    if not isinstance(memory, tuple): # A directory.
+        memory = load_translation_memory(memory, cache_dir)
+    index = get_memory_index(model, cache_dir)
+    sources = rank_memory_sources(memory, lang)
+    # Texts that are not translated in any of the sources need not be compared.
+    translated = {
+        index.ids[key] for source in sources for key in source.strings if key in index.ids
+    }
+    trigrams = { }
+    for trigram, ids in index.trigrams.items():
+        ids = [i for i in ids if i in translated]
+        if ids:
+            trigrams[trigram] = ids
+    return lambda key: suggest_translation(index, trigrams, sources, model, key)
+
+
+def make_missing_string(key, deprecated, base_string, suggest):
+    # Returns a copy of `base_string`, with values replaced by the suggested translation, if any.
+    suggestion = suggest(key) if suggest is not None and not deprecated else None
+    if suggestion is None:
+        add_message(MessageCode.ADDED_STRING, FileID.TARGET, 0, key)
+        return clone_string(base_string)
+
+    values, filename, source_key, similarity = suggestion
+    add_message(MessageCode.SUGGESTED_STRING, FileID.TARGET, 0, key, filename, source_key)
+    comment = " Suggested from %s" % os.path.basename(filename)
+    if source_key != key:
+        comment += ' (the translation of "%s", %d%% similar)' % (source_key, similarity * 100)
+    dom = etree.Element("string", dict(base_string.dom.attrib))
+    # Comments cannot contain `--`, which may occur in filenames and keys.
+    dom.append(etree.Comment(re.sub(r"-(?=-)", "- ", comment) + " "))
+    string_values = [ ]
+    for text in values:
+        node = etree.SubElement(dom, "value")
+        node.text = text
+        string_values.append(Value(
+            placeholders=scan_placeholders(text),
+            text=text,
+            line=base_string.line,
+            dom=node,
+        ))
+    return base_string._replace(values=string_values, dom=dom)
+
+
+def make_formatter(indentation):
+    # Returns a function that reformats a node located at the given nesting level, and
+    # a function that returns whitespace to put before a node at the given level.
     cache = ['\n', '\n', '\n']
 
+    def indent(level):
+        while level >= len(cache):
+            cache.append(cache[-1] + indentation)
+        return cache[level]
+
     def recurse(node, level):
         level += 1
         if len(node) > 0:
@@ -507,75 +1655,1297 @@ def reformat(root, flat, indentation):
         if not text or text.isspace():
             node.tail = cache[level - (2 if node.getnext() is None else 1)]
 
-    recurse(root, 2 - flat)
+    return recurse, indent
 
 
-def run(args):
-    # Load langfiles.
-    fid = FileID.NONE
-    try:
-        load_xml_schema()
-        fid = FileID.MODEL
-        model = load_model_language(args["--model"])
-        if model is None and args["--assign-attributes"]:
-            add_error(FileID.MODEL, 0, "`--assign-attributes` requires a model langfile.")
-            return False
+def reformat(root, flat, indentation):
+    make_formatter(indentation)[0](root, 2 - flat)
 
-        fid = FileID.BASE
-        base = args["--base"] and load_language(FileID.BASE, args["--base"])
-        fid = FileID.TARGET
-        lang = load_target_language(args["<langfile>"])
-    except (etree.XMLSyntaxError, etree.DocumentInvalid) as e:
-        for s in map(stringify, e.error_log.filter_from_errors()):
-            m = re.match(r'[^\x00-\x1F"*:<>?|]*:([0-9]+):[0-9]*:\w*:', s)
-            if m is not None:
-                add_error(fid, int(m.group(1)), s[m.end():])
-            else:
-                add_error(fid, 0, s)
-        return False
 
-    # Validate langfiles.
-    if model is not None:
-        check_summary(lang, model)
-    if base is not None and (model is None or base.filename != model.filename):
-        check_summary(lang, base)
-    if model is None:
-        if base is not None:
-            check_placeholders_sanity(FileID.BASE, base)
-        check_placeholders_sanity(FileID.TARGET, lang)
-    else:
-        if base is not None and base.filename != model.filename:
-            check_available_strings(FileID.BASE, base, model)
-        check_available_strings(FileID.TARGET, lang, model)
-        if args["--add-missing"]:
-            check_missing_strings(FileID.BASE, base, model)
-        else:
-            check_missing_strings(FileID.TARGET, lang, model)
+XML_DECLARATION = b'<?xml version="1.0" encoding="utf-8"?>\n'
 
-    if args["update"]:
-        # Mutate the langfile.
-        if args["--move-comments"]:
-            move_comments(lang.dom.getroot())
-        if base is not None:
-            modify_strings(
-                lang, base, model or base,
-                reorder=args["--reorder"],
-                add_missing=args["--add-missing"],
-                only=args["--only"],
-            )
-        if args["--assign-attributes"]:
-            assign_attributes(lang, model)
-        reformat(lang.dom.getroot(), *args["--indent"])
 
-        # Write it back to the disk.
-        serialized = \
-            b'<?xml version="1.0" encoding="utf-8"?>\n' + etree.tostring(lang.dom, encoding="utf-8")
-        if not args["--no-backup"]:
-            replace_file(args["<langfile>"], select_backup(args["<langfile>"]))
-        with open(args["<langfile>"], "wb") as f:
-            f.write(serialized)
+def write_language(dom, f, flat, indentation):
+    # Reformats the document and writes it to the binary file `f`. The result is the same as of
+    # `reformat` followed by `etree.tostring`, but children of the root are reformatted and
+    # written one by one, without building the whole output in memory.
+    root = dom.getroot()
+    f.write(XML_DECLARATION)
+    if len(root) == 0 or root.nsmap or dom.docinfo.doctype or dom.docinfo.internalDTD is not None:
+        # Unusual documents are not worth the effort.
+        reformat(root, flat, indentation)
+        f.write(etree.tostring(dom, encoding="utf-8"))
+        return
 
-    return True
+    recurse, indent = make_formatter(indentation)
+    level = 3 - flat
+    first_indent = indent(level) # Also makes `recurse` see indentation for this level.
+    text = root.text
+    if not text or text.isspace():
+        root.text = first_indent
+    text = root.tail
+    if not text or text.isspace():
+        root.tail = indent(level - (2 if root.getnext() is None else 1))
+    # Top-level comments and processing instructions are written without separators.
+    for node in reversed(list(root.itersiblings(preceding=True))):
+        f.write(etree.tostring(node, encoding="utf-8", with_tail=False))
+    with etree.xmlfile(f, encoding="utf-8") as xf:
+        with xf.element(root.tag, root.attrib):
+            xf.write(root.text)
+            for child in root:
+                recurse(child, level)
+                xf.write(child)
+    # `etree.tostring` does not output anything after the root's tail (e.g., trailing comments).
+    f.write(root.tail.encode("utf-8"))
+
+
+def report_xml_error(fid, e):
+    report_error_log(fid, e.error_log)
+
+
+def report_error_log(fid, error_log):
+    for s in map(stringify, error_log.filter_from_errors()):
+        m = re.match(r'[^\x00-\x1F"*:<>?|]*:([0-9]+):[0-9]*:\w*:', s)
+        if m is not None:
+            add_error(fid, int(m.group(1)), s[m.end():])
+        else:
+            add_error(fid, 0, s)
+
+
+def load_guarded(fid, function, *args):
+    # Returns `(ok, result)`.
+    try:
+        return True, function(*args)
+    except (etree.XMLSyntaxError, etree.DocumentInvalid) as e:
+        report_xml_error(fid, e)
+        return False, None
+
+
+def load_xml_schema_phase():
+    with phase("load_xml_schema"):
+        return load_xml_schema()
+
+
+def load_reference_model(args):
+    model = args["--model"]
+    if not isinstance(model, Language):
+        with phase("parse", FileID.MODEL):
+            model = load_model_language(model, select_cache_dir(args))
+    return model
+
+
+def load_reference_base(args):
+    base = args["--base"]
+    if base is not None and not isinstance(base, Language):
+        with phase("parse", FileID.BASE):
+            base = load_language(FileID.BASE, base)
+    return base
+
+
+def load_target(args, filename):
+    with phase("parse", FileID.TARGET):
+        # A recovered DOM is never written back.
+        return load_target_language(
+            filename, keep_dom=args["update"], recover=args["--recover"] and not args["update"],
+        )
+
+
+def run_load_task(fid, function, args, in_thread):
+    # Returns `(ok, result, collector)`.
+    collector = AnnotationCollector()
+    previous = set_collector(collector)
+    try:
+        # Each thread has its own XSD (see `ThreadState`).
+        if in_thread and not load_guarded(FileID.NONE, load_xml_schema)[0]:
+            return False, None, collector
+        ok, result = load_guarded(fid, function, *args)
+        return ok, result, collector
+    finally:
+        set_collector(previous)
+
+
+# Threads to load the model, base, and target langfiles at once. lxml releases the GIL while
+# parsing and validating. Kept across runs, so that each thread compiles the XSD only once, until
+# worker processes are started (see `stop_loader`).
+g_loader = None
+g_loader_lock = threading.Lock()
+
+
+def get_loader():
+    global g_loader
+    from multiprocessing.pool import ThreadPool
+
+    with g_loader_lock:
+        if g_loader is None:
+            g_loader = ThreadPool(3)
+    return g_loader
+
+
+def stop_loader():
+    # Forking while other threads are alive is unsafe, so this is called before starting worker
+    # processes. The next run starts new threads.
+    global g_loader
+    with g_loader_lock:
+        if g_loader is not None:
+            g_loader.close()
+            g_loader.join()
+            g_loader = None
+
+
+def load_all(args, filename=None):
+    # Returns `(ok, model, base, target, target_collector)`. Annotations for the model and base
+    # langfiles go to the current collector, and are the same as if the files were loaded one
+    # after another, stopping at the first failure. Those for the target are kept separately.
+    # `target` is `None` if `filename` is, or if the references or the target cannot be loaded.
+    tasks = [(FileID.MODEL, load_reference_model, (args, ))]
+    if args["--base"] is not None:
+        tasks.append((FileID.BASE, load_reference_base, (args, )))
+    if filename is not None:
+        tasks.append((FileID.TARGET, load_target, (args, filename)))
+    pending = (
+        (not isinstance(args["--model"], Language)) +
+        (args["--base"] is not None and not isinstance(args["--base"], Language)) +
+        (filename is not None)
+    )
+
+    if pending >= 2 and g_state.phases is None:
+        loader = get_loader()
+        results = [
+            loader.apply_async(run_load_task, (fid, function, task_args, True))
+            for fid, function, task_args in tasks
+        ]
+        outcomes = ((fid, result.get()) for (fid, _, _), result in zip(tasks, results))
+    else:
+        # Profiling measures the phases one after another.
+        tasks.insert(0, (FileID.NONE, load_xml_schema_phase, ( )))
+        outcomes = (
+            (fid, run_load_task(fid, function, task_args, False))
+            for fid, function, task_args in tasks
+        )
+
+    collector = get_collector()
+    target_collector = AnnotationCollector()
+    loaded = {FileID.MODEL: None, FileID.BASE: None, FileID.TARGET: None}
+    for fid, (ok, result, task_collector) in outcomes:
+        if fid == FileID.TARGET:
+            target_collector.extend(task_collector)
+        else:
+            collector.extend(task_collector)
+            if not ok:
+                return False, None, None, None, target_collector
+        loaded[fid] = result
+        if fid == FileID.MODEL and result is None:
+            for option in ("--assign-attributes", "--suggest-from"):
+                if args[option] not in (None, False):
+                    add_error(FileID.MODEL, 0, "`%s` requires a model langfile." % option)
+                    return False, None, None, None, target_collector
+    return True, loaded[FileID.MODEL], loaded[FileID.BASE], loaded[FileID.TARGET], target_collector
+
+
+def load_references(args):
+    # Returns `(ok, model, base)`.
+    return load_all(args)[:3]
+
+
+def process_langfile(args, filename, model, base):
+    # Returns the target language, or `None` if it cannot be loaded.
+    ok, lang = load_guarded(FileID.TARGET, load_target, args, filename)
+    if ok:
+        process_language(args, filename, lang, model, base)
+    return lang
+
+
+def process_language(args, filename, lang, model, base):
+    # Validate the langfile.
+    with phase("check_summary", FileID.TARGET):
+        if model is not None:
+            check_summary(lang, model)
+        if base is not None and (model is None or base.filename != model.filename):
+            check_summary(lang, base)
+    if model is None:
+        if base is not None:
+            with phase("check_placeholders_sanity", FileID.BASE):
+                check_placeholders_sanity(FileID.BASE, base)
+        with phase("check_placeholders_sanity", FileID.TARGET):
+            check_placeholders_sanity(FileID.TARGET, lang)
+    else:
+        if base is not None and base.filename != model.filename:
+            with phase("check_available_strings", FileID.BASE):
+                check_available_strings(FileID.BASE, base, model)
+        with phase("check_available_strings", FileID.TARGET):
+            check_available_strings(FileID.TARGET, lang, model)
+        with phase("check_values", FileID.TARGET):
+            check_values(FileID.TARGET, lang, model)
+        if args["--add-missing"]:
+            with phase("check_missing_strings", FileID.BASE):
+                check_missing_strings(FileID.BASE, base, model)
+        else:
+            with phase("check_missing_strings", FileID.TARGET):
+                check_missing_strings(FileID.TARGET, lang, model)
+
+    if args["update"]:
+        # Mutate the langfile.
+        if args["--move-comments"]:
+            with phase("move_comments", FileID.TARGET):
+                move_comments(lang.dom.getroot())
+        if base is not None:
+            suggest = None
+            if args["--suggest-from"] is not None:
+                with phase("load_translation_memory", FileID.TARGET):
+                    suggest = make_suggester(args, lang, model)
+            with phase("modify_strings", FileID.TARGET):
+                modify_strings(
+                    lang, base, model or base,
+                    reorder=args["--reorder"],
+                    add_missing=args["--add-missing"],
+                    only=args["--only"],
+                    suggest=suggest,
+                )
+        if args["--assign-attributes"]:
+            with phase("assign_attributes", FileID.TARGET):
+                assign_attributes(lang, model)
+
+        # Write it back to the disk.
+        with phase("write", FileID.TARGET):
+            if update_file(
+                filename,
+                lambda f: write_language(lang.dom, f, *args["--indent"]),
+                backup=not args["--no-backup"],
+            ):
+                add_message(MessageCode.MODIFIED, FileID.TARGET, 0)
+
+
+def load_and_process(args, filename):
+    # Returns the target language, or `None` if it cannot be loaded.
+    ok, model, base, lang, target_collector = load_all(args, filename)
+    if not ok:
+        return None
+    get_collector().extend(target_collector)
+    if lang is not None:
+        process_language(args, filename, lang, model, base)
+    return lang
+
+
+# Library interface. Unlike `main`, these functions neither exit nor print anything, and can be
+# called from multiple threads simultaneously. Each call gets its own `AnnotationCollector`.
+# Model and base langfiles may be given either as filenames or as `Language`s obtained from
+# `load_model` and `load_base`; annotations for the latter are not repeated in each `Result`.
+
+Result = collections.namedtuple("Result", "success  collector  language")
+
+
+def make_args(
+    update=False, model=None, base=None, indent="2", move_comments=False,
+    assign_attributes=False, add_missing=False, only=None, reorder=False, backup=True,
+    cache_dir=None, recover=False, suggest_from=None,
+):
+    # The same as `transform_args` would return.
+    return {
+        "check": not update,
+        "update": update,
+        "--model": model,
+        "--base": base,
+        "--indent": parse_indentation_spec(indent),
+        "--move-comments": move_comments,
+        "--assign-attributes": assign_attributes,
+        "--add-missing": add_missing,
+        "--only": only if only is None else list(only),
+        "--reorder": reorder,
+        "--suggest-from": suggest_from,
+        "--no-backup": not backup,
+        "--no-cache": cache_dir is None,
+        "--cache-dir": cache_dir,
+        "--recover": recover,
+        "--profile": False,
+    }
+
+
+def collect(function, *args):
+    collector = AnnotationCollector()
+    previous = set_collector(collector)
+    try:
+        language = function(*args)
+    finally:
+        set_collector(previous)
+    return Result(success=collector.success, collector=collector, language=language)
+
+
+def load_model(filename=None, cache_dir=None):
+    # If `filename` is `None`, `English.xml` from the current directory is loaded, if present.
+    def load():
+        try:
+            return load_model_language(filename, cache_dir)
+        except (etree.XMLSyntaxError, etree.DocumentInvalid) as e:
+            report_xml_error(FileID.MODEL, e)
+            return None
+
+    return collect(load)
+
+
+def load_base(filename):
+    def load():
+        try:
+            return load_language(FileID.BASE, filename)
+        except (etree.XMLSyntaxError, etree.DocumentInvalid) as e:
+            report_xml_error(FileID.BASE, e)
+            return None
+
+    return collect(load)
+
+
+def check(target, model=None, base=None, cache_dir=None, recover=False):
+    return collect(load_and_process, make_args(
+        model=model, base=base, cache_dir=cache_dir, recover=recover,
+    ), target)
+
+
+def update(target, model=None, base=None, **options):
+    # See `make_args` for `options`.
+    return collect(load_and_process, make_args(True, model, base, **options), target)
+
+
+# State shared by all files of a batch run: `(args, ok, model, base, reference_collector)`.
+# Worker processes either inherit it from the parent or load it once in `init_batch`.
+g_batch = None
+
+
+def init_batch(args):
+    global g_batch
+    if args["--profile"]:
+        start_profiling()
+    if g_batch is None:
+        reference = AnnotationCollector()
+        set_collector(reference)
+        ok, model, base = load_references(args)
+        if ok and model is not None:
+            # Worker processes inherit it, if forked.
+            get_value_index(model)
+        g_batch = args, ok, model, base, reference
+
+
+def process_batch_file(filename):
+    args, ok, model, base, reference = g_batch
+    collector = reference.copy()
+    set_collector(collector)
+    if ok:
+        process_langfile(args, filename, model, base)
+    return collector
+
+
+def process_batch_single(args, filename):
+    # The only langfile is loaded along with the model and base ones.
+    global g_batch
+    if args["--profile"]:
+        start_profiling()
+    reference = AnnotationCollector()
+    set_collector(reference)
+    ok, model, base, lang, target_collector = load_all(args, filename)
+    g_batch = args, ok, model, base, reference
+    collector = reference.copy()
+    set_collector(collector)
+    if ok:
+        collector.extend(target_collector)
+        if lang is not None:
+            process_language(args, filename, lang, model, base)
+    return collector
+
+
+def process_batch(args, filenames):
+    import multiprocessing
+
+    if len(filenames) == 1 and g_batch is None:
+        return [process_batch_single(args, filenames[0])]
+    init_batch(args)
+    jobs = min(args["--jobs"] or multiprocessing.cpu_count(), len(filenames))
+    if jobs <= 1:
+        return list(map(process_batch_file, filenames))
+    stop_loader()
+    pool = multiprocessing.Pool(jobs, init_batch, (args, ))
+    try:
+        # `map` preserves the order of its input regardless of scheduling.
+        return pool.map(process_batch_file, filenames)
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def run_batch(args, filenames):
+    # Returns the collector with annotations for the model and base langfiles,
+    # and an ordered mapping from filenames to their own collectors.
+    global g_batch
+    g_batch = None # Might be left by a previous run in the same process.
+    cache_dir = select_cache_dir(args) if args["check"] and not args["--profile"] else None
+    if cache_dir is None:
+        collectors = process_batch(args, filenames)
+        return g_batch[-1], collections.OrderedDict(zip(filenames, collectors))
+
+    # Results of `check` depend on nothing but contents of the files involved.
+    model = args["--model"] or MODEL_LANGFILE
+    references = (
+        hash_file(model) if os.path.isfile(model) else None,
+        args["--base"] and hash_file(args["--base"]),
+    )
+    reference_name = "reference-%s.json" % make_cache_key(*references)
+    result_names = { }
+    collectors = { }
+    for filename in filenames:
+        name = result_names[filename] = \
+            "%s-%s.json" % (
+                "recovered" if args["--recover"] else "result",
+                make_cache_key(hash_file(filename), *references),
+            )
+        log = read_cache(cache_dir, name)
+        if log is not None:
+            collectors[filename] = restore_collector(log)
+
+    log = read_cache(cache_dir, reference_name)
+    pending = [filename for filename in filenames if filename not in collectors]
+    if pending or log is None:
+        collectors.update(zip(pending, process_batch(args, pending)))
+        reference = g_batch[-1]
+        write_cache(cache_dir, reference_name, prepare_json_log(reference))
+        for filename in pending:
+            write_cache(cache_dir, result_names[filename], prepare_json_log(collectors[filename]))
+    else:
+        reference = restore_collector(log)
+    prune_cache(cache_dir, args["--cache-size"])
+    return reference, collections.OrderedDict(
+        (filename, collectors[filename]) for filename in filenames
+    )
+
+
+def map_in_pool(args, function, items, initializer, initargs):
+    # Like `map`, but spreads the work among up to `--jobs` worker processes.
+    import multiprocessing
+
+    jobs = min(args["--jobs"] or multiprocessing.cpu_count(), len(items))
+    if jobs <= 1:
+        initializer(*initargs)
+        return list(map(function, items))
+    stop_loader()
+    pool = multiprocessing.Pool(jobs, initializer, initargs)
+    try:
+        return pool.map(function, items)
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+# Sharded checks. Each shard reports the langfiles it got, and the reports are merged into what
+# a single run over all langfiles would produce.
+
+def normalize_shard_path(filename):
+    # The same langfile gets the same name on any machine, however it was given, if the current
+    # directory is the same directory of the checkout.
+    try:
+        filename = os.path.relpath(filename)
+    except ValueError:
+        filename = os.path.abspath(filename) # On another drive.
+    return filename.replace(os.sep, "/")
+
+
+def select_shard(filenames, shard):
+    # Returns langfiles of the shard under their normalized names, which reports use, too.
+    # A langfile always goes to the same shard, on any machine.
+    index, count = shard
+    filenames = map(normalize_shard_path, filenames)
+    return [
+        filename for filename in filenames
+        if (zlib.crc32(filename.encode("utf-8")) & 0xFFFFFFFF) % count == index - 1
+    ]
+
+
+def merge_reports(reports):
+    # Takes batch JSON logs produced with `--shard` and returns the one a single run would produce.
+    # Raises `ValueError` unless they are all the shards of a run, each exactly once.
+    try:
+        shards = sorted((report["shard"][0], report["shard"][1]) for report in reports)
+        count = shards[0][1]
+        if shards != [(i, count) for i in range(1, count + 1)]:
+            raise ValueError("Expected shards 1/%d to %d/%d, got %s." % (
+                count, count, count, ", ".join("%d/%d" % shard for shard in shards),
+            ))
+        success = all(report["reference"]["success"] for report in reports)
+        files = { }
+        for report in reports:
+            for filename, log in report["files"].items():
+                if filename in files:
+                    raise ValueError("%s is reported by more than one shard." % filename)
+                files[filename] = log
+                success = success and log["success"]
+    except (KeyError, IndexError, TypeError):
+        raise ValueError("Not a report produced with `--shard`.")
+    return {"success": success, "files": files}
+
+
+# Incremental checks in a git repository.
+
+class GitError(Exception):
+    pass
+
+
+def git(cwd, *args):
+    # Returns the output of the command.
+    import subprocess
+
+    try:
+        process = subprocess.Popen(
+            ("git", ) + args, cwd=cwd, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+        )
+    except OSError as e:
+        raise GitError("Cannot run git: %s" % e)
+    output, errors = process.communicate()
+    if process.returncode != 0:
+        raise GitError(errors.decode("utf-8", "replace").strip() or "git failed.")
+    return output
+
+
+def describe_model_strings(lang):
+    # Everything checks of other langfiles depend on, by key.
+    result = collections.defaultdict(list)
+    for (key, deprecated), string in lang.strings.items():
+        result[key].append(
+            (deprecated, string.gif, [(value.placeholders, value.text) for value in string.values]),
+        )
+    return result
+
+
+def find_changed_model_keys(old, new):
+    # Returns `None` if everything should be checked again.
+    if old is None or new is None or old.summary[:-2] != new.summary[:-2]:
+        return None
+    old = describe_model_strings(old)
+    new = describe_model_strings(new)
+    return {key for key in set(old) | set(new) if old.get(key) != new.get(key)}
+
+
+def load_model_revision(rev, filename, top):
+    # Returns `None` if the model langfile is absent or broken in that revision.
+    import io
+
+    path = os.path.relpath(os.path.realpath(filename), top).replace(os.sep, "/")
+    try:
+        data = git(top, "show", "%s:%s" % (rev, path))
+    except GitError:
+        return None
+    previous = set_collector(AnnotationCollector())
+    try:
+        return load_language(FileID.MODEL, io.BytesIO(data))
+    except (etree.XMLSyntaxError, etree.DocumentInvalid):
+        return None
+    finally:
+        set_collector(previous)
+
+
+def select_changed_langfiles(args, filenames):
+    # Returns langfiles to check and the set of keys to restrict reports about unchanged langfiles
+    # to. The latter is `None` if unchanged langfiles should not be checked at all.
+    rev = args["--changed-since"]
+    # The repository is the one the first of the given paths belongs to.
+    path = args["<langfile>"][0]
+    cwd = path if os.path.isdir(path) else os.path.dirname(path) or "."
+    top = os.path.realpath(git(cwd, "rev-parse", "--show-toplevel").decode(
+        sys.getfilesystemencoding(),
+    ).rstrip("\n"))
+    # Deleted files are of no interest. New files have changed even before they are committed.
+    names = (
+        git(top, "diff", "--name-only", "-z", "--diff-filter=d", rev, "--") +
+        git(top, "ls-files", "--others", "--exclude-standard", "-z")
+    ).split(b"\0")
+    changed = {
+        os.path.realpath(os.path.join(top, name.decode(sys.getfilesystemencoding())))
+        for name in names if name
+    }
+    model = args["--model"] or MODEL_LANGFILE
+    if not os.path.isfile(model) or os.path.realpath(model) not in changed:
+        return [f for f in filenames if os.path.realpath(f) in changed], None
+
+    result = load_model(args["--model"], select_cache_dir(args))
+    keys = find_changed_model_keys(
+        load_model_revision(rev, model, top), result.language,
+    )
+    if keys is None:
+        return filenames, None
+    return filenames, {
+        filename: keys for filename in filenames if os.path.realpath(filename) not in changed
+    }
+
+
+# Messages that depend on particular strings of the model langfile: `{code: number of leading
+# details that are keys}`.
+KEYED_MESSAGES = {
+    MessageCode.MISSING_STRING: 1,
+    MessageCode.UNKNOWN_KEY: 1,
+    MessageCode.MISSING_PLACEHOLDER: 1,
+    MessageCode.EXTRA_PLACEHOLDER: 1,
+    MessageCode.INVALID_ATTRIBUTE: 1,
+    MessageCode.UNTRANSLATED_VALUE: 1,
+    MessageCode.DUPLICATE_VALUE: 2,
+}
+
+
+def restrict_collector(collector, keys):
+    # Only errors and annotations for the given strings of the model are left for the target.
+    other = collector.copy()
+    other.messages[FileID.TARGET] = [
+        (code, line, details) for code, line, details in collector.messages[FileID.TARGET]
+        if any(key in keys for key in details[:KEYED_MESSAGES.get(code, 0)])
+    ]
+    return other
+
+
+# Comparing versions of the model langfile.
+
+ModelChanges = collections.namedtuple(
+    "ModelChanges", "added  removed  deprecated  undeprecated  placeholders  gif",
+)
+
+
+def get_reference_string(model, key):
+    # The string other langfiles are compared to (see `check_available_strings`).
+    return model.strings.get((key, False)) or model.strings[key, True]
+
+
+def diff_models(old, new):
+    old_keys = old.deprecated_summary
+    new_keys = new.deprecated_summary
+    common = [key for key in new_keys if key in old_keys]
+    placeholders = collections.OrderedDict()
+    gif = [ ]
+    for key in common:
+        a = get_reference_string(old, key)
+        b = get_reference_string(new, key)
+        a_placeholders = a.values[0].placeholders if a.values else frozenset()
+        b_placeholders = b.values[0].placeholders if b.values else frozenset()
+        if a_placeholders != b_placeholders:
+            placeholders[key] = sorted(a_placeholders), sorted(b_placeholders)
+        if a.gif != b.gif:
+            gif.append(key)
+    return ModelChanges(
+        added=[key for key in new_keys if key not in old_keys],
+        removed=[key for key in old_keys if key not in new_keys],
+        deprecated=[
+            key for key in common
+            if new_keys[key] == Deprecated.TRUE and old_keys[key] != Deprecated.TRUE
+        ],
+        undeprecated=[
+            key for key in common
+            if new_keys[key] != Deprecated.TRUE and old_keys[key] == Deprecated.TRUE
+        ],
+        placeholders=placeholders,
+        gif=gif,
+    )
+
+
+def restrict_language(lang, keys):
+    return lang._replace(
+        strings=collections.OrderedDict(
+            (k, string) for k, string in lang.strings.items() if k[0] in keys
+        ),
+        deprecated_summary=collections.OrderedDict(
+            (key, d) for key, d in lang.deprecated_summary.items() if key in keys
+        ),
+    )
+
+
+# `(errors, messages that appear with the new model, messages that go away)` for a langfile.
+LanguageDelta = collections.namedtuple("LanguageDelta", "errors  added  resolved")
+
+g_model_diff = None
+
+
+def init_model_diff(old, new, keys):
+    global g_model_diff
+    g_model_diff = old, new, keys
+
+
+def check_restricted(lang, model):
+    collector = AnnotationCollector()
+    previous = set_collector(collector)
+    try:
+        check_available_strings(FileID.TARGET, lang, model)
+        check_missing_strings(FileID.TARGET, lang, model)
+    finally:
+        set_collector(previous)
+    return collector.messages[FileID.TARGET]
+
+
+def diff_language(filename):
+    old, new, keys = g_model_diff
+    collector = AnnotationCollector()
+    previous = set_collector(collector)
+    try:
+        lang = restrict_language(load_target_language(filename, keep_dom=False), keys)
+    except (etree.XMLSyntaxError, etree.DocumentInvalid) as e:
+        report_xml_error(FileID.TARGET, e)
+        return LanguageDelta(collector.errors[FileID.TARGET], [ ], [ ])
+    finally:
+        set_collector(previous)
+
+    before = check_restricted(lang, old)
+    after = check_restricted(lang, new)
+    remaining = collections.Counter(before)
+    added = [ ]
+    for message in after:
+        if remaining[message] > 0:
+            remaining[message] -= 1
+        else:
+            added.append(message)
+    resolved = [ ]
+    for message in reversed(before):
+        if remaining[message] > 0:
+            remaining[message] -= 1
+            resolved.append(message)
+    resolved.reverse()
+    return LanguageDelta([ ], added, resolved)
+
+
+def diff_languages(args, old, new, filenames):
+    # Returns an ordered mapping from filenames to `LanguageDelta`s.
+    keys = find_changed_model_keys(old, new)
+    if keys is None: # Summaries differ; not a concern of langfiles, though.
+        keys = set(old.deprecated_summary) | set(new.deprecated_summary)
+    old = restrict_language(old, keys)
+    new = restrict_language(new, keys)
+    cache_dir = select_cache_dir(args)
+    names = { }
+    deltas = { }
+    if cache_dir is not None:
+        references = hash_file(args["<old-model>"]), hash_file(args["<new-model>"])
+        for filename in filenames:
+            name = names[filename] = \
+                "delta-%s.json" % make_cache_key(hash_file(filename), *references)
+            data = read_cache(cache_dir, name)
+            if data is not None:
+                errors, added, resolved = data
+                deltas[filename] = LanguageDelta(
+                    [(line, text) for line, text in errors],
+                    [(code, line, tuple(details)) for code, line, details in added],
+                    [(code, line, tuple(details)) for code, line, details in resolved],
+                )
+
+    pending = [filename for filename in filenames if filename not in deltas]
+    results = map_in_pool(args, diff_language, pending, init_model_diff, (old, new, keys))
+    deltas.update(zip(pending, results))
+    if cache_dir is not None:
+        for filename, delta in zip(pending, results):
+            write_cache(cache_dir, names[filename], list(delta))
+        prune_cache(cache_dir, args["--cache-size"])
+    return collections.OrderedDict((filename, deltas[filename]) for filename in filenames)
+
+
+# Translation coverage. Each key of the model langfile (and each unknown key any langfile has,
+# after them) gets an index, and sets of keys are bitsets over these indices.
+
+def make_bitset(indices):
+    bits = bytearray(max(indices) // 8 + 1 if indices else 1)
+    for i in indices:
+        bits[i >> 3] |= 1 << (i & 7)
+    bits.reverse()
+    return int(binascii.hexlify(bytes(bits)), 16)
+
+
+def iter_bitset(bits):
+    while bits:
+        lowest = bits & -bits
+        yield lowest.bit_length() - 1
+        bits ^= lowest
+
+
+def count_bitset(bits):
+    return bin(bits).count("1")
+
+
+# `present` and `mismatch` are bitsets over the model's keys.
+LanguageCoverage = collections.namedtuple(
+    "LanguageCoverage", "errors  present  mismatch  unknown_keys",
+)
+
+g_coverage = None
+
+
+def init_coverage(model):
+    global g_coverage
+    g_coverage = model, {key: i for i, key in enumerate(model.deprecated_summary)}
+
+
+def scan_coverage(filename):
+    model, index = g_coverage
+    collector = AnnotationCollector()
+    previous = set_collector(collector)
+    try:
+        lang = scan_language(FileID.TARGET, filename)
+    except (etree.XMLSyntaxError, etree.DocumentInvalid) as e:
+        report_xml_error(FileID.TARGET, e)
+        return LanguageCoverage(collector.errors[FileID.TARGET], 0, 0, [ ])
+    finally:
+        set_collector(previous)
+
+    present = [ ]
+    mismatch = [ ]
+    unknown_keys = [ ]
+    for key in lang.deprecated_summary:
+        i = index.get(key)
+        if i is None:
+            unknown_keys.append(key)
+        else:
+            present.append(i)
+    for (key, deprecated), string in lang.strings.items():
+        i = index.get(key)
+        if i is None:
+            continue
+        model_string = model.strings.get((key, deprecated)) or model.strings[key, not deprecated]
+        if model_string.values:
+            model_placeholders = model_string.values[0].placeholders
+            if any(value.placeholders != model_placeholders for value in string.values):
+                mismatch.append(i)
+    return LanguageCoverage([ ], make_bitset(present), make_bitset(mismatch), unknown_keys)
+
+
+# Bitsets of a langfile over the key index. `unknown` lies outside the model's keys.
+CoverageRow = collections.namedtuple(
+    "CoverageRow", "errors  translated  missing  unknown  mismatch",
+)
+
+
+def compute_coverage(model, coverages):
+    # Returns the list of indexed keys, the number of strings every langfile should have,
+    # and an ordered mapping from filenames to `CoverageRow`s.
+    keys = list(model.deprecated_summary)
+    required = make_bitset([
+        i for i, deprecated in enumerate(model.deprecated_summary.values())
+        if deprecated != Deprecated.TRUE
+    ])
+    unknown_index = { }
+    rows = collections.OrderedDict()
+    for filename, coverage in coverages.items():
+        unknown = [ ]
+        for key in coverage.unknown_keys:
+            i = unknown_index.get(key)
+            if i is None:
+                i = unknown_index[key] = len(keys)
+                keys.append(key)
+            unknown.append(i)
+        rows[filename] = CoverageRow(
+            errors=coverage.errors,
+            translated=coverage.present & required,
+            missing=required & ~coverage.present if not coverage.errors else 0,
+            unknown=make_bitset(unknown),
+            mismatch=coverage.mismatch,
+        )
+    return keys, count_bitset(required), rows
+
+
+def print_coverage(required, rows, stream):
+    error_prefix = "\x1B[1;31mERROR\x1B[0m" if stream.isatty() else "ERROR"
+    for filename, row in rows.items():
+        if row.errors:
+            print("%s:" % stringify(filename), file=stream)
+            for line, text in row.errors:
+                print_log_entry(compose_prefix(error_prefix, line), text, stream)
+            continue
+        translated = count_bitset(row.translated)
+        print(
+            "%s: %.1f%% (%d/%d), %d missing, %d unknown, %d with mismatched placeholders." % (
+                stringify(filename), 100.0 * translated / required if required else 100.0,
+                translated, required, count_bitset(row.missing), count_bitset(row.unknown),
+                count_bitset(row.mismatch),
+            ),
+            file=stream,
+        )
+
+
+def write_coverage_csv(keys, rows, stream):
+    import csv
+
+    # Every langfile typically lacks only a few keys, so lookups in sets are cheaper
+    # than testing bits of large integers.
+    columns = [
+        (
+            set(iter_bitset(row.missing)),
+            set(iter_bitset(row.unknown)),
+            set(iter_bitset(row.mismatch)),
+            bool(row.errors),
+        )
+        for row in rows.values()
+    ]
+    writer = csv.writer(stream, lineterminator="\n")
+    writer.writerow(["key"] + list(rows))
+    for i, key in enumerate(keys):
+        cells = [key]
+        for missing, unknown, mismatch, failed in columns:
+            if failed:
+                cells.append("error")
+            elif i in missing:
+                cells.append("missing")
+            elif i in unknown:
+                cells.append("unknown")
+            elif i in mismatch:
+                cells.append("mismatch")
+            else:
+                cells.append("")
+        writer.writerow(cells)
+
+
+def execute_coverage(args, stream):
+    # Returns the exit code.
+    model = load_model(args["--model"], select_cache_dir(args))
+    if model.language is None:
+        print_model_errors(model, "coverage", stream)
+        return 1
+
+    filenames = expand_langfiles(args["<langfile>"], [args["--model"] or MODEL_LANGFILE])
+    coverages = collections.OrderedDict(zip(
+        filenames, map_in_pool(args, scan_coverage, filenames, init_coverage, (model.language, )),
+    ))
+    keys, required, rows = compute_coverage(model.language, coverages)
+    ok = all(not row.errors for row in rows.values())
+    if args["--json"]:
+        def get_keys(bits):
+            return [keys[i] for i in iter_bitset(bits)]
+
+        print_json_log(
+            {
+                "success": ok,
+                "required": required,
+                "files": {
+                    filename: {
+                        "errors": row.errors,
+                        "translated": count_bitset(row.translated),
+                        "missing": get_keys(row.missing),
+                        "unknown": get_keys(row.unknown),
+                        "mismatch": get_keys(row.mismatch),
+                    }
+                    for filename, row in rows.items()
+                },
+            },
+            stream,
+        )
+    elif args["--csv"]:
+        write_coverage_csv(keys, rows, stream)
+    else:
+        print_coverage(required, rows, stream)
+    return 0 if ok else 1
+
+
+# Compiled langfiles. A langfile that passes the checks is flattened onto the model langfile, so
+# that every key of the model gets the values the bot would use, and written in a format that
+# can be searched without reading it as a whole (e.g., through `mmap`). Integers are 32-bit
+# unsigned little-endian; offsets are from the beginning of the file:
+#
+#     magic, number of keys, size of the header
+#     header: JSON object with `format`, `hash`, `language`, and `source`
+#     index: (key offset, key size, record offset, record size) for each key, sorted by key
+#     keys: UTF-8
+#     records: JSON objects with `gif`, `values`, `placeholders`, and `source`
+#
+# `placeholders` lists indices of format items in each of `values`. `source` of a record tells
+# where the values come from: `target`, `default` (the default variant of the same `base`
+# among the compiled langfiles), or `model`.
+
+COMPILED_MAGIC = b"TGWWLNG\0"
+COMPILED_FORMAT = 1
+COMPILED_EXTENSION = ".tgwwl"
+COMPILED_PREFIX = struct.Struct("<8sII")
+COMPILED_ENTRY = struct.Struct("<IIII")
+
+
+class CompiledLanguage(object):
+    # Looks keys up in a compiled langfile, reading only the parts of the file it needs.
+
+    def __init__(self, filename):
+        import json
+        import mmap
+
+        with open(filename, "rb") as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self._count, size = COMPILED_PREFIX.unpack_from(self._map, 0)
+        if magic != COMPILED_MAGIC:
+            self._map.close()
+            raise ValueError("Not a compiled langfile: %s" % filename)
+        self._index = COMPILED_PREFIX.size + size
+        self.header = json.loads(self._map[COMPILED_PREFIX.size:self._index].decode("utf-8"))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __len__(self):
+        return self._count
+
+    def __contains__(self, key):
+        return self._find(key) is not None
+
+    def __getitem__(self, key):
+        record = self.get(key)
+        if record is None:
+            raise KeyError(key)
+        return record
+
+    def _entry(self, i):
+        return COMPILED_ENTRY.unpack_from(self._map, self._index + i * COMPILED_ENTRY.size)
+
+    def _find(self, key):
+        # Binary search over the index. Returns the entry of `key`, or `None`.
+        key = key.encode("utf-8")
+        low, high = 0, self._count
+        while low < high:
+            middle = (low + high) // 2
+            entry = self._entry(middle)
+            found = self._map[entry[0]:entry[0] + entry[1]]
+            if found < key:
+                low = middle + 1
+            elif found > key:
+                high = middle
+            else:
+                return entry
+        return None
+
+    def get(self, key, default=None):
+        import json
+
+        entry = self._find(key)
+        if entry is None:
+            return default
+        return json.loads(self._map[entry[2]:entry[2] + entry[3]].decode("utf-8"))
+
+    def keys(self):
+        for i in range(self._count):
+            entry = self._entry(i)
+            yield self._map[entry[0]:entry[0] + entry[1]].decode("utf-8")
+
+    def close(self):
+        self._map.close()
+
+
+def read_compiled_header(filename):
+    # Returns `None` if the file is missing or is not a compiled langfile.
+    import json
+
+    try:
+        with open(filename, "rb") as f:
+            magic, _, size = COMPILED_PREFIX.unpack(f.read(COMPILED_PREFIX.size))
+            if magic != COMPILED_MAGIC:
+                return None
+            return json.loads(f.read(size).decode("utf-8"))
+    except (IOError, OSError, ValueError, struct.error):
+        return None
+
+
+def write_compiled_language(filename, header, records):
+    import json
+
+    def encode(obj):
+        return json.dumps(
+            obj, ensure_ascii=False, separators=(',', ':'), sort_keys=True,
+        ).encode("utf-8")
+
+    header = encode(header)
+    items = sorted((key.encode("utf-8"), encode(record)) for key, record in records.items())
+    key_offset = COMPILED_PREFIX.size + len(header) + COMPILED_ENTRY.size * len(items)
+    record_offset = key_offset + sum(len(key) for key, _ in items)
+    chunks = [COMPILED_PREFIX.pack(COMPILED_MAGIC, len(items), len(header)), header]
+    for key, record in items:
+        chunks.append(COMPILED_ENTRY.pack(key_offset, len(key), record_offset, len(record)))
+        key_offset += len(key)
+        record_offset += len(record)
+    chunks.extend(key for key, _ in items)
+    chunks.extend(record for _, record in items)
+    # The bot may run under another user.
+    write_file(filename, b"".join(chunks), 0o644)
+
+
+def read_language_attributes(filename):
+    # Returns `(base, default)` of the langfile, or `None` if it is malformed. Only the beginning
+    # of the file is parsed.
+    try:
+        for _, node in etree.iterparse(filename, events=("start", ), tag="language"):
+            return node.get("base"), is_true(node.get("isDefault"))
+    except etree.XMLSyntaxError:
+        pass
+    return None
+
+
+def select_default_variants(filenames):
+    # Maps each langfile to the default variant of its `base` among `filenames`, or to `None`.
+    attributes = {filename: read_language_attributes(filename) for filename in filenames}
+    defaults = { }
+    for filename in filenames:
+        if attributes[filename] is not None and attributes[filename][1]:
+            defaults.setdefault(attributes[filename][0], filename)
+    fallbacks = { }
+    for filename in filenames:
+        default = attributes[filename] and defaults.get(attributes[filename][0])
+        fallbacks[filename] = default if default != filename else None
+    return fallbacks
+
+
+def flatten_language(lang, default, model):
+    # Returns a mapping from keys of the model to records of the compiled langfile.
+    sources = [("target", lang), ("default", default), ("model", model)]
+    records = { }
+    for key in model.deprecated_summary:
+        for source, language in sources:
+            if language is None:
+                continue
+            # A deprecated translation is still better than a fallback.
+            string = language.strings.get((key, False)) or language.strings.get((key, True))
+            if string is not None and string.values:
+                break
+        model_string = model.strings.get((key, False)) or model.strings[key, True]
+        records[key] = {
+            "gif": model_string.gif,
+            "values": [value.text for value in string.values] if string is not None else [ ],
+            "placeholders": [
+                sorted({
+                    placeholder.index
+                    for placeholder in map(parse_placeholder, value.placeholders)
+                    if placeholder is not None
+                })
+                for value in (string.values if string is not None else ())
+            ],
+            "source": source,
+        }
+    return records
+
+
+g_compile = None
+
+
+def init_compile(model, defaults):
+    global g_compile
+    g_compile = model, defaults
+
+
+def compile_langfile(task):
+    filename, default, key, output = task
+    model, defaults = g_compile
+    lang = collect(scan_language, FileID.TARGET, filename).language
+    summary = lang.summary
+    write_compiled_language(
+        output,
+        {
+            "format": COMPILED_FORMAT,
+            "hash": key,
+            "language": {
+                "name": summary.name,
+                "base": summary.base,
+                "variant": summary.variant,
+                "owner": summary.owner,
+                "default": summary.default,
+            },
+            "source": os.path.basename(filename),
+        },
+        flatten_language(lang, defaults.get(default), model),
+    )
+
+
+def execute_compile(args, stream):
+    # Returns the exit code.
+    cache_dir = select_cache_dir(args)
+    model = load_model(args["--model"], cache_dir)
+    if model.language is None:
+        print_model_errors(model, "compile", stream)
+        return 1
+
+    model_filename = args["--model"] or MODEL_LANGFILE
+    filenames = expand_langfiles(args["<langfile>"], [model_filename])
+    defaults = select_default_variants(filenames)
+    model_hash = hash_file(model_filename)
+    hashes = {filename: hash_file(filename) for filename in filenames}
+    outputs = collections.OrderedDict()
+    sources = { }
+    for filename in filenames:
+        name = os.path.splitext(os.path.basename(filename))[0] + COMPILED_EXTENSION
+        outputs[filename] = output = os.path.join(args["--output-dir"], name)
+        # Langfiles with the same name in different directories would overwrite each other.
+        if output in sources:
+            print_log_entry(
+                "ERROR",
+                "Both %s and %s would be compiled to %s." % (sources[output], filename, output),
+                stream,
+            )
+            return 2
+        sources[output] = filename
+    keys = { }
+    for filename in filenames:
+        # A compiled langfile depends on the langfile itself, the model, and the default variant.
+        default = defaults[filename]
+        key = make_cache_key(hashes[filename], model_hash, default and hashes[default])
+        header = read_compiled_header(outputs[filename])
+        if header is None or header.get("format") != COMPILED_FORMAT or header.get("hash") != key:
+            keys[filename] = key
+
+    # Only langfiles that are going to be (re)compiled, and their default variants, are checked.
+    checked = [
+        filename for filename in filenames
+        if filename in keys or any(defaults[stale] == filename for stale in keys)
+    ]
+    if checked:
+        reference, collectors = run_batch(dict(args, check=True), checked)
+    else:
+        reference, collectors = model.collector, { }
+    statuses = collections.OrderedDict()
+    tasks = [ ]
+    for filename in filenames:
+        default = defaults[filename]
+        if filename not in keys:
+            statuses[filename] = "up-to-date"
+        elif not collectors[filename].success or default and not collectors[default].success:
+            statuses[filename] = "failed"
+        else:
+            statuses[filename] = "compiled"
+            tasks.append((filename, default, keys[filename], outputs[filename]))
+
+    if tasks and not os.path.isdir(args["--output-dir"]):
+        os.makedirs(args["--output-dir"])
+    default_languages = {
+        default: collect(scan_language, FileID.BASE, default).language
+        for default in {task[1] for task in tasks if task[1] is not None}
+    }
+    map_in_pool(args, compile_langfile, tasks, init_compile, (model.language, default_languages))
+
+    ok = all(status != "failed" for status in statuses.values())
+    if args["--json"]:
+        print_json_log(
+            {
+                "command": "compile",
+                "success": ok,
+                "files": {
+                    filename: {
+                        "status": status,
+                        "output": outputs[filename],
+                        "report":
+                            prepare_json_log(collectors[filename])
+                            if filename in collectors else None,
+                    }
+                    for filename, status in statuses.items()
+                },
+            },
+            stream,
+        )
+        return 0 if ok else 1
+
+    separate = print_pretty_log(reference, None, None, args["--model"], stream)
+    for filename, collector in collectors.items():
+        separate = print_pretty_log(
+            collector.since(reference), filename, None, args["--model"], stream, separate,
+        )
+    if separate:
+        print(file=stream)
+    for filename, status in statuses.items():
+        if status == "compiled":
+            text = "Compiled to %s." % outputs[filename]
+        elif status == "up-to-date":
+            text = "%s is up to date." % outputs[filename]
+        elif collectors[filename].success:
+            text = "Not compiled: the default variant, %s, failed the check." % defaults[filename]
+        else:
+            text = "Not compiled: the check failed."
+        print_log_entry(stringify(filename), text, stream)
+    return 0 if ok else 1
 
 
 MESSAGE_TEMPLATES = {
@@ -584,6 +2954,10 @@ MESSAGE_TEMPLATES = {
     MessageCode.MISSING_PLACEHOLDER: 'Missing `{1}` in "{0}".',
     MessageCode.EXTRA_PLACEHOLDER: 'Extra `{1}` in "{0}".',
     MessageCode.ADDED_STRING: 'Adding "{0}".',
+    MessageCode.UNTRANSLATED_VALUE: '"{0}" is not translated: it is the same as in {model}.',
+    MessageCode.DUPLICATE_VALUE: '"{0}" has the same value as "{1}".',
+    MessageCode.SUGGESTED_STRING: 'Adding "{0}" with the translation of "{2}" from {1}.',
+    MessageCode.MODIFIED: 'The langfile has been modified.',
     MessageCode.NOT_FOUND: 'Model langfile is not found. Some checks will be skipped.',
     MessageCode.NOT_DEFAULT: 'This is not a default language, yet it is selected as a model.',
     MessageCode.CLOSED: 'This is a closed langfile. Its owner is https://t.me/{0}',
@@ -599,7 +2973,12 @@ MESSAGE_TEMPLATES = {
     MessageCode.DANGLING_TEXT: 'Text outside `<value>`.',
 }
 
-INFO_MESSAGES = {MessageCode.ADDED_STRING, MessageCode.CLOSED}
+INFO_MESSAGES = {
+    MessageCode.ADDED_STRING,
+    MessageCode.SUGGESTED_STRING,
+    MessageCode.MODIFIED,
+    MessageCode.CLOSED,
+}
 
 
 def compose_prefix(prefix, line):
@@ -610,8 +2989,23 @@ def print_log_entry(prefix, text, stream):
     print(prefix, stringify(text), sep=": ", file=stream)
 
 
-def print_pretty_log(collector, lang, base, model, stream):
-    should_add_blank_line = False
+def print_model_errors(model, command, stream):
+    # For commands that cannot do without a model langfile, when `model` has failed to load.
+    for line, text in model.collector.errors[FileID.MODEL]:
+        print_log_entry(compose_prefix("ERROR", line), text, stream)
+    if model.collector.success:
+        print_log_entry("ERROR", "`%s` requires a model langfile." % command, stream)
+
+
+def print_json_log(log, stream):
+    import json
+
+    json.dump(log, stream, ensure_ascii=False, separators=(',', ':'), sort_keys=True)
+    print(file=stream)
+
+
+def print_pretty_log(collector, lang, base, model, stream, should_add_blank_line=False):
+    # Returns whether a blank line should separate subsequent output.
     if stream.isatty():
         info_prefix = "\x1B[1;34mINFO\x1B[0m"
         warning_prefix = "\x1B[1;33mWARNING\x1B[0m"
@@ -650,9 +3044,26 @@ def print_pretty_log(collector, lang, base, model, stream):
         for line, text in errors:
             print_log_entry(compose_prefix(error_prefix, line), text, stream)
 
+    if collector.profile:
+        if should_add_blank_line:
+            print(file=stream)
+        else:
+            should_add_blank_line = True
+        print("Profile:", file=stream)
+        for name, fid, wall, cpu, memory in collector.profile:
+            text = "%.2f ms, CPU %.2f ms" % (wall * 1000, cpu * 1000)
+            if memory is not None:
+                text += ", peak memory %.1f KiB" % (memory / 1024.0)
+            print_log_entry(
+                "  %s" % name if fid == FileID.NONE else "  %s %s" % (name, stringify(files[fid])),
+                text,
+                stream,
+            )
+    return should_add_blank_line
+
 
 def prepare_json_log(collector):
-    return {
+    log = {
         "success": collector.success,
         "annotations": [
             {"file": fid, "errors": errors, "messages": messages}
@@ -660,17 +3071,200 @@ def prepare_json_log(collector):
             if errors or messages
         ],
     }
+    if collector.profile:
+        log["profile"] = [
+            {"phase": name, "file": fid, "wall": wall, "cpu": cpu, "memory": memory}
+            for name, fid, wall, cpu, memory in collector.profile
+        ]
+    return log
+
+
+def restore_collector(log):
+    # The inverse of `prepare_json_log`.
+    collector = AnnotationCollector()
+    collector.success = log["success"]
+    for annotation in log["annotations"]:
+        fid = annotation["file"]
+        collector.errors[fid] = [(line, text) for line, text in annotation["errors"]]
+        collector.messages[fid] = [
+            (code, line, tuple(details)) for code, line, details in annotation["messages"]
+        ]
+    return collector
+
+
+def prepare_batch_json_log(reference, collectors):
+    return {
+        "success": reference.success and all(c.success for c in collectors.values()),
+        "files": {
+            filename: prepare_json_log(collector) for filename, collector in collectors.items()
+        },
+    }
 
 
-def main():
-    # Parse arguments.
-    try:
-        args = transform_args(docopt.docopt(__doc__, version="tgwwlang.py v%s" % __version__))
-    except (docopt.DocoptExit, schema.SchemaError) as e:
-        print(stringify(e), file=sys.stderr)
-        sys.exit(2)
+def print_model_changes(changes, stream):
+    headers = (
+        ("added", "Added"),
+        ("removed", "Removed"),
+        ("deprecated", "Deprecated"),
+        ("undeprecated", "No longer deprecated"),
+        ("gif", "Changed `isgif`"),
+    )
+    should_add_blank_line = False
+    for field, header in headers:
+        keys = getattr(changes, field)
+        if keys:
+            if should_add_blank_line:
+                print(file=stream)
+            should_add_blank_line = True
+            print("%s:" % header, file=stream)
+            for key in keys:
+                print("  %s" % stringify(key), file=stream)
+    if changes.placeholders:
+        if should_add_blank_line:
+            print(file=stream)
+        should_add_blank_line = True
+        print("Changed placeholders:", file=stream)
+        for key, (old, new) in changes.placeholders.items():
+            print("  %s: %s -> %s" % (
+                stringify(key), ", ".join(old) or "<none>", ", ".join(new) or "<none>",
+            ), file=stream)
+    return should_add_blank_line
+
+
+def print_language_delta(delta, filename, old_model, new_model, stream, should_add_blank_line):
+    if stream.isatty():
+        fixed_prefix = "\x1B[1;32mFIXED\x1B[0m"
+    else:
+        fixed_prefix = "FIXED"
+    # New problems are printed like those found by `check`.
+    collector = AnnotationCollector()
+    collector.errors[FileID.TARGET] = delta.errors
+    collector.messages[FileID.TARGET] = delta.added
+    should_add_blank_line = print_pretty_log(
+        collector, filename, None, new_model, stream, should_add_blank_line,
+    )
+    if delta.resolved:
+        if not delta.errors and not delta.added:
+            if should_add_blank_line:
+                print(file=stream)
+            should_add_blank_line = True
+            print("%s:" % stringify(filename), file=stream)
+        for code, line, details in delta.resolved:
+            print_log_entry(
+                compose_prefix(fixed_prefix, line),
+                MESSAGE_TEMPLATES[code].format(
+                    *map(stringify, details),
+                    file=filename, target=filename, base=None, model=old_model
+                ),
+                stream,
+            )
+    return should_add_blank_line
+
+
+def execute_model_diff(args, stream):
+    # Returns the exit code.
+    old_model = args["<old-model>"]
+    new_model = args["<new-model>"]
+    cache_dir = select_cache_dir(args)
+    old = load_model(old_model, cache_dir)
+    new = load_model(new_model, cache_dir)
+    if not old.success or not new.success:
+        for result, filename in ((old, old_model), (new, new_model)):
+            for line, text in result.collector.errors[FileID.MODEL]:
+                print_log_entry(compose_prefix("%s: ERROR" % filename, line), text, stream)
+        return 1
+
+    changes = diff_models(old.language, new.language)
+    filenames = expand_langfiles(args["<langfile>"], [old_model, new_model])
+    deltas = diff_languages(args, old.language, new.language, filenames)
+    ok = all(not delta.errors for delta in deltas.values())
+    if args["--json"]:
+        print_json_log(
+            {
+                "success": ok,
+                "changes": dict(changes._asdict(), placeholders=changes.placeholders),
+                "files": {
+                    filename: {
+                        "errors": delta.errors,
+                        "added": delta.added,
+                        "resolved": delta.resolved,
+                    }
+                    for filename, delta in deltas.items()
+                },
+            },
+            stream,
+        )
+    else:
+        separate = print_model_changes(changes, stream)
+        for filename, delta in deltas.items():
+            separate = print_language_delta(
+                delta, filename, old_model, new_model, stream, separate,
+            )
+    return 0 if ok else 1
+
+
+def execute_merge_reports(args, stream):
+    # Returns the exit code.
+    import json
 
-    ok = run(args)
+    reports = [ ]
+    for filename in args["<shard-report>"]:
+        try:
+            with open(filename, "rb") as f:
+                reports.append(json.loads(f.read().decode("utf-8")))
+        except (IOError, OSError, ValueError) as e:
+            print_log_entry("%s: ERROR" % stringify(filename), stringify(e), stream)
+            return 2
+    try:
+        log = merge_reports(reports)
+    except ValueError as e:
+        print_log_entry("ERROR", stringify(e), stream)
+        return 2
+    print_json_log(log, stream)
+    return 0 if log["success"] else 1
+
+
+def execute(args, stream):
+    # Returns the exit code.
+    if args["model-diff"]:
+        return execute_model_diff(args, stream)
+    if args["coverage"]:
+        return execute_coverage(args, stream)
+    if args["compile"]:
+        return execute_compile(args, stream)
+    if args["merge-reports"]:
+        return execute_merge_reports(args, stream)
+    paths = args["<langfile>"]
+    batch = (
+        len(paths) > 1 or not os.path.isfile(paths[0]) or
+        args["--changed-since"] is not None or args["--shard"] is not None
+    )
+    filenames = expand_langfiles(paths, [args["--model"] or MODEL_LANGFILE, args["--base"]])
+    if args["--shard"] is not None:
+        filenames = select_shard(filenames, args["--shard"])
+    if args["update"] and args["--suggest-from"] is not None:
+        # Every langfile is filled from the directory as it was before any of them is updated.
+        cache_dir = select_cache_dir(args)
+        args = dict(args)
+        args["--suggest-from"] = load_translation_memory(args["--suggest-from"], cache_dir)
+        if cache_dir is not None:
+            prune_cache(cache_dir, args["--cache-size"])
+    restrictions = { }
+    failure = None
+    if args["--changed-since"] is not None:
+        try:
+            filenames, restrictions = select_changed_langfiles(args, filenames)
+        except GitError as e:
+            filenames, failure = [ ], stringify(e)
+    try:
+        reference, collectors = run_batch(args, filenames)
+    finally:
+        stop_profiling()
+    if failure is not None:
+        reference.add_error(FileID.NONE, 0, failure)
+    for filename, keys in (restrictions or { }).items():
+        collectors[filename] = restrict_collector(collectors[filename], keys)
+    ok = reference.success and all(c.success for c in collectors.values())
     if args["--report"] is None:
         report_stream = None
     elif sys.version_info.major >= 3:
@@ -678,25 +3272,233 @@ def main():
     else:
         report_stream = open(args["--report"], "wb")
     if args["--json"]:
-        import json
-
-        json.dump(
-            prepare_json_log(g_collector),
-            sys.stdout,
-            ensure_ascii=False,
-            separators=(',', ':'),
-            sort_keys=True,
-        )
-        print()
+        if not batch:
+            log = prepare_json_log(collectors[paths[0]])
+        else:
+            log = prepare_batch_json_log(reference, collectors)
+            if args["--shard"] is not None:
+                # `merge-reports` needs to know whether the model and base langfiles are fine
+                # even if the shard has got no langfiles.
+                log["shard"] = list(args["--shard"])
+                log["reference"] = prepare_json_log(reference)
+        print_json_log(log, stream)
     elif report_stream is None:
-        report_stream = sys.stdout
+        report_stream = stream
 
     if report_stream is not None:
-        print_pretty_log(
-            g_collector, args["<langfile>"], args["--base"], args["--model"], report_stream,
-        )
+        if not batch:
+            for filename, collector in collectors.items():
+                print_pretty_log(
+                    collector, filename, args["--base"], args["--model"], report_stream,
+                )
+        else:
+            # Annotations for the model and base langfiles are printed only once.
+            separate = print_pretty_log(
+                reference, None, args["--base"], args["--model"], report_stream,
+            )
+            for filename, collector in collectors.items():
+                separate = print_pretty_log(
+                    collector.since(reference), filename, args["--base"], args["--model"],
+                    report_stream, separate,
+                )
+        if report_stream is not stream:
+            report_stream.close()
+
+    return 0 if ok else 1
+
+
+# The protocol between `serve` and its clients: a client sends a JSON object with `fingerprint`
+# (see `get_code_fingerprint`), `argv`, `cwd`, and `isatty` (whether output is colored) on a
+# single line. The server acknowledges it with an empty line when it starts handling it, then
+# replies with `{"status": <exit code>, "output": <text for stdout>}` and closes the connection.
+# Any other reply makes the client do the job by itself.
+
+# Seconds the server waits for a client to send its request or to accept the reply, and a client
+# waits for the server to connect and to acknowledge the request.
+REQUEST_TIMEOUT = 10
+
+
+def get_code_fingerprint():
+    # A server started before the script or the XSD changed must not handle requests.
+    return make_cache_key(hash_file(os.path.realpath(__file__)))
+
+
+def forward(argv, args):
+    # `args` need not be validated: the server does it by itself.
+    path = select_socket(args)
+    try:
+        owner = os.stat(path).st_uid
+    except OSError:
+        return None
+    # A socket of another user, e.g. created in advance at the default path, might be anybody's
+    # server.
+    if hasattr(os, "getuid") and owner != os.getuid():
+        return None
+
+    import json
+    import socket
+
+    if not hasattr(socket, "AF_UNIX"):
+        return None
+    request = {
+        "fingerprint": get_code_fingerprint(),
+        "argv": argv,
+        "cwd": os.getcwd(),
+        "isatty": sys.stdout.isatty(),
+    }
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    # A server that is stuck, or busy with another request, is not waited for.
+    client.settimeout(REQUEST_TIMEOUT)
+    try:
+        client.connect(path)
+        client.sendall(json.dumps(request).encode("utf-8") + b"\n")
+        f = client.makefile("rb")
+        try:
+            if f.readline() != b"\n":
+                return None
+            # The job itself may take any time.
+            client.settimeout(None)
+            response = json.loads(f.readline().decode("utf-8"))
+        finally:
+            f.close()
+        return response["status"], response["output"]
+    except (IOError, OSError, ValueError, KeyError, TypeError):
+        # `socket.error` and `socket.timeout` are subclasses of `IOError`.
+        return None
+    finally:
+        client.close()
+
+
+class CapturedOutput(object):
+    def __init__(self, isatty):
+        self.chunks = [ ]
+        self.write = self.chunks.append
+        self.tty = isatty
+
+    def isatty(self):
+        return self.tty
+
+    def flush(self):
+        pass
+
+    def getvalue(self):
+        return "".join(self.chunks)
+
+
+def handle_request(line, fingerprint):
+    import json
+
+    request = json.loads(line.decode("utf-8"))
+    if request.get("fingerprint") != fingerprint:
+        return {"error": "The server runs different code; restart it."}
+    # Requests are served one at a time, so changing the directory is safe.
+    os.chdir(request["cwd"])
+    try:
+        args = transform_args(docopt.docopt(__doc__, request["argv"], help=False))
+    except (docopt.DocoptExit, schema.SchemaError) as e:
+        return {"error": stringify(e)}
+    if args["serve"] or args["--help"] or args["--version"]:
+        return {"error": "Not supported by the server."}
+    set_collector(AnnotationCollector())
+    output = CapturedOutput(request["isatty"])
+    status = execute(args, output)
+    return {"status": status, "output": output.getvalue()}
+
+
+def is_serving(path):
+    import socket
+
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        client.connect(path)
+        return True
+    except (IOError, OSError):
+        return False
+    finally:
+        client.close()
+
+
+def serve(args):
+    import json
+    import signal
+    import socket
+    import traceback
+
+    if not hasattr(socket, "AF_UNIX"):
+        print("Unix sockets are not supported on this platform.", file=sys.stderr)
+        return 2
+    path = select_socket(args)
+    if is_serving(path):
+        print("Already serving at %s" % path, file=sys.stderr)
+        return 1
+    if os.path.exists(path):
+        os.remove(path) # Left by a server that has crashed.
+
+    # Remove the socket on termination.
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(path)
+    try:
+        # Only the user may connect; nobody can connect before `listen` anyway.
+        os.chmod(path, 0o600)
+        server.listen(16)
+        fingerprint = get_code_fingerprint()
+        load_xml_schema()
+        while True:
+            connection, _ = server.accept()
+            try:
+                # Otherwise a client that never sends a whole line would block the server.
+                connection.settimeout(REQUEST_TIMEOUT)
+                f = connection.makefile("rb")
+                try:
+                    line = f.readline()
+                finally:
+                    f.close()
+                # A client that has given up waiting gets its job done by itself, so the request is
+                # handled only if the client is still there.
+                connection.sendall(b"\n")
+                try:
+                    response = handle_request(line, fingerprint)
+                except Exception:
+                    response = {"error": traceback.format_exc()}
+                connection.sendall(json.dumps(response).encode("utf-8") + b"\n")
+            except (IOError, OSError):
+                pass # The client has gone.
+            finally:
+                connection.close()
+    except KeyboardInterrupt:
+        return 0
+    finally:
+        server.close()
+        os.remove(path)
+
+
+def main():
+    # Parse arguments.
+    argv = sys.argv[1:]
+    try:
+        # `-h` and `-V` exit here, before anything but `docopt` is imported.
+        args = docopt.docopt(__doc__, argv, version="tgwwlang.py v%s" % __version__)
+    except docopt.DocoptExit as e:
+        print(stringify(e), file=sys.stderr)
+        sys.exit(2)
+
+    # Runs passed to the server need neither `schema` nor lxml.
+    if not args["serve"]:
+        response = forward(argv, args)
+        if response is not None:
+            status, output = response
+            sys.stdout.write(output)
+            sys.exit(status)
+    try:
+        args = transform_args(args)
+    except schema.SchemaError as e:
+        print(stringify(e), file=sys.stderr)
+        sys.exit(2)
 
-    sys.exit(0 if ok else 1)
+    if args["serve"]:
+        sys.exit(serve(args))
+    sys.exit(execute(args, sys.stdout))
 
 
 if __name__ == "__main__":